@@ -0,0 +1,86 @@
+"""
+Encodes a reference clip with every encoder profile and reports encode speed and
+output bitrate, so profile settings can be tuned on the machine that runs the backend.
+
+    python -m benchmarks.encoder_profiles
+    python -m benchmarks.encoder_profiles --input static/background_videos/mc_video.mp4 --duration 20
+
+Without --input a 1080x1920 60 fps test pattern with a tone is generated. The clip is
+rendered through `plan_render`, so subtitles, fades and scaling are part of the cost.
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+import ffmpeg
+
+from server.utils.encoder_profiles import ENCODER_PROFILES, FFMPEG_THREADS
+from server.utils.ffmpeg_runner import probe, run_ffmpeg
+from server.utils.render_planner import RenderSource, plan_render
+
+SUBTITLES = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1080
+PlayResY: 1920
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, OutlineColour, Bold, Outline, Alignment, MarginV
+Style: Default,Montserrat,90,&H00FFFFFF,&H00000000,1,4,5,10
+
+[Events]
+Format: Layer, Start, End, Style, Text
+"""
+
+
+async def make_reference_clip(path: Path, duration: float):
+    video = ffmpeg.input("testsrc2=size=1080x1920:rate=60", f="lavfi", t=duration)
+    audio = ffmpeg.input("sine=frequency=220:sample_rate=48000", f="lavfi", t=duration)
+    await run_ffmpeg(ffmpeg.output(video, audio, str(path), vcodec="libx264", preset="ultrafast", crf=12, acodec="aac"))
+
+
+def write_subtitles(path: Path, duration: float):
+    events = []
+    for second in range(int(duration)):
+        events.append(f"Dialogue: 0,0:00:{second:02d}.00,0:00:{second:02d}.90,Default,word number {second + 1}")
+    path.write_text(SUBTITLES + "\n".join(events) + "\n", encoding="utf-8")
+
+
+async def main(input_path, duration: float, profiles):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        if input_path is None:
+            input_path = tmp / "reference.mp4"
+            print(f"Generating a {duration:.0f}s 1080x1920@60 reference clip...")
+            await make_reference_clip(input_path, duration)
+        subtitles_path = tmp / "subtitles.ass"
+        write_subtitles(subtitles_path, duration)
+        source = RenderSource(background=str(input_path), start=0, duration=duration, speech=str(input_path))
+
+        print(f"threads per encode: {FFMPEG_THREADS}")
+        print(f"{'profile':<10}{'seconds':>9}{'fps':>9}{'realtime':>10}{'kbit/s':>9}{'MB':>8}  resolution")
+        for name in profiles:
+            output_file = tmp / f"{name}.mp4"
+            stream = plan_render(source, subtitles_path, {"profile": name}, output_file)
+            started = time.perf_counter()
+            await run_ffmpeg(stream, duration=duration)
+            elapsed = time.perf_counter() - started
+
+            info = await probe(output_file, v="error", select_streams="v:0", count_packets=None)
+            stream_info = info["streams"][0]
+            frames = int(stream_info.get("nb_read_packets") or stream_info.get("nb_frames") or 0)
+            size = output_file.stat().st_size
+            print(
+                f"{name:<10}{elapsed:>9.2f}{frames / elapsed:>9.1f}{duration / elapsed:>9.2f}x"
+                f"{size * 8 / duration / 1000:>9.0f}{size / 1e6:>8.2f}  {stream_info['width']}x{stream_info['height']}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", type=Path, help="Reference clip, generated when omitted")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of the clip to encode")
+    parser.add_argument("--profiles", nargs="+", default=list(ENCODER_PROFILES), choices=list(ENCODER_PROFILES))
+    args = parser.parse_args()
+    asyncio.run(main(args.input, args.duration, args.profiles))
@@ -0,0 +1,93 @@
+"""
+Measures password verification, the CPU cost of a login, at several scrypt costs, so
+PASSWORD_SCRYPT_* can be chosen for the machine that runs the backend.
+
+    python -m benchmarks.password_hashing
+    python -m benchmarks.password_hashing --costs 14,8,5 15,8,3 17,8,1 --logins 200
+
+For every cost it reports the latency of one verification, logins/second per core
+(one thread), and the throughput and latency percentiles of `--concurrency` logins
+at once through `PasswordHasher` and its thread pool, as the login route runs them.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import statistics
+import time
+
+from server.utils.hashing import PasswordHasher, ScryptCost
+
+PASSWORD = "correct horse battery staple"
+
+
+def parse_cost(value: str) -> ScryptCost:
+    log_n, r, p = (int(part) for part in value.split(","))
+    return ScryptCost(log_n, r, p)
+
+
+def single_thread(hasher: PasswordHasher, hashed: str, seconds: float) -> list:
+    timings = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline or len(timings) < 3:
+        started = time.perf_counter()
+        if not hasher.verify_sync(PASSWORD, hashed):
+            raise RuntimeError("Verification failed")
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def concurrent(hasher: PasswordHasher, hashed: str, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def login():
+        async with semaphore:
+            started = time.perf_counter()
+            if not await hasher.verify(PASSWORD, hashed):
+                raise RuntimeError("Verification failed")
+            timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    return timings, time.perf_counter() - started
+
+
+async def main(args):
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores, {args.workers or cores} hashing threads, {args.concurrency} concurrent logins\n")
+    print(f"  {'cost (log_n,r,p)':<18}{'memory':>10}{'1 login ms':>12}{'logins/s/core':>15}"
+          f"{'pool logins/s':>15}{'p50 ms':>9}{'p95 ms':>9}")
+
+    # What login cost before, for scale
+    legacy = PasswordHasher(ScryptCost(14, 8, 1))
+    timings = single_thread(legacy, hashlib.sha256(PASSWORD.encode()).hexdigest(), 0.5)
+    print(f"  {'legacy sha256':<18}{'-':>10}{statistics.median(timings) * 1000:>12.4f}{1 / statistics.mean(timings):>15.0f}")
+
+    for cost in args.costs:
+        hasher = PasswordHasher(cost, max_workers=args.workers)
+        hashed = hasher.hash_sync(PASSWORD)
+        one = single_thread(hasher, hashed, args.seconds)
+        timings, elapsed = await concurrent(hasher, hashed, args.logins, args.concurrency)
+        timings.sort()
+        hasher.shutdown()
+        print(
+            f"  {f'{cost.log_n},{cost.r},{cost.p}':<18}{128 * cost.r * cost.n / 2 ** 20:>6.0f} MiB"
+            f"{statistics.median(one) * 1000:>12.1f}{1 / statistics.mean(one):>15.1f}"
+            f"{len(timings) / elapsed:>15.1f}{statistics.median(timings) * 1000:>9.1f}"
+            f"{timings[int(len(timings) * 0.95)] * 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--costs", type=parse_cost, nargs="+",
+        default=[parse_cost(c) for c in ("13,8,10", "14,8,5", "15,8,3", "16,8,2", "17,8,1")],
+        help="log_n,r,p triples, the defaults are OWASP's equivalent scrypt settings",
+    )
+    parser.add_argument("--logins", type=int, default=100, help="Logins per cost through the pool")
+    parser.add_argument("--concurrency", type=int, default=32, help="Logins in flight at once")
+    parser.add_argument("--workers", type=int, default=0, help="Hashing threads, 0 for one per core")
+    parser.add_argument("--seconds", type=float, default=2.0, help="Time spent measuring one thread")
+    asyncio.run(main(parser.parse_args()))
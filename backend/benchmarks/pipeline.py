@@ -0,0 +1,281 @@
+"""
+End-to-end benchmark of the generation pipeline: every simulated user runs
+generateBrainrot, waits for the job, downloads the result ZIP and then renders the
+final video with generateDownload, all through the real FastAPI app.
+
+External services are replaced by local stand-ins, so runs are repeatable and free:
+OpenAI TTS by `benchmarks.stub_tts_server`, MongoDB by mongomock-motor and the
+background videos by a generated test pattern. Run it from backend/:
+
+    pip install mongomock-motor
+    python -m benchmarks.pipeline --users 1 4 8
+    python -m benchmarks.pipeline --users 4 --jobs 3 --words 300 --subtitle-mode transcribe
+
+For every concurrency level it reports end-to-end latency percentiles, throughput,
+per-stage timings from the Prometheus histograms, CPU time (including ffmpeg) and
+peak RSS. Whisper runs with the configured model in transcribe mode only.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# The app reads its configuration at import
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("JWT_SECRET", "benchmark-secret-that-is-at-least-32-bytes")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("JOB_BACKEND", "local")
+
+WORDS = (
+    "the quick brown fox jumps over lazy dogs while gamers speedrun minecraft parkour and "
+    "everyone in chat spams skibidi rizz because nobody actually reads the terms of service"
+).split()
+
+
+def make_script(words: int, seed: int) -> str:
+    rng = random.Random(seed)
+    sentences, count = [], 0
+    while count < words:
+        length = min(rng.randint(6, 16), words - count)
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+        count += length
+    return " ".join(sentences)
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def stage_snapshot() -> dict:
+    """Current per-stage histogram state: stage -> (count, sum, [(upper bound, cumulative count)])."""
+    from server.metrics import stage_seconds
+
+    stages = {}
+    for metric in stage_seconds.collect():
+        for sample in metric.samples:
+            stage = sample.labels["stage"]
+            count, total, buckets = stages.get(stage, (0.0, 0.0, []))
+            if sample.name.endswith("_count"):
+                count = sample.value
+            elif sample.name.endswith("_sum"):
+                total = sample.value
+            elif sample.name.endswith("_bucket"):
+                buckets = buckets + [(float(sample.labels["le"]), sample.value)]
+            stages[stage] = (count, total, buckets)
+    return stages
+
+
+def stage_report(before: dict, after: dict):
+    print(f"  {'stage':<18}{'count':>7}{'mean s':>10}{'~p95 s':>10}{'total s':>10}")
+    for stage, (count, total, buckets) in sorted(after.items(), key=lambda item: -item[1][1]):
+        old_count, old_total, old_buckets = before.get(stage, (0.0, 0.0, []))
+        old = dict(old_buckets)
+        buckets = [(bound, value - old.get(bound, 0.0)) for bound, value in buckets]
+        count, total = count - old_count, total - old_total
+        if count <= 0:
+            continue
+        print(f"  {stage:<18}{count:>7.0f}{total / count:>10.3f}{bucket_percentile(buckets, count, 0.95):>10.3f}{total:>10.2f}")
+
+
+def bucket_percentile(buckets, count: float, fraction: float) -> float:
+    # Linear interpolation inside the bucket that holds the percentile, like histogram_quantile
+    rank, lower, previous = fraction * count, 0.0, 0.0
+    for bound, cumulative in sorted(buckets):
+        if cumulative >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - previous) / max(cumulative - previous, 1e-9)
+        lower, previous = bound, cumulative
+    return lower
+
+
+def usage() -> tuple:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (
+        own.ru_utime + own.ru_stime,
+        children.ru_utime + children.ru_stime,
+        own.ru_maxrss * scale,
+        children.ru_maxrss * scale,
+    )
+
+
+async def make_background(path: Path, duration: float):
+    import ffmpeg
+    from server.utils.ffmpeg_runner import run_ffmpeg
+
+    video = ffmpeg.input("testsrc2=size=1080x1920:rate=30", f="lavfi", t=duration)
+    audio = ffmpeg.input("anoisesrc=amplitude=0.05:sample_rate=44100", f="lavfi", t=duration)
+    await run_ffmpeg(ffmpeg.output(
+        video, audio, str(path), vcodec="libx264", preset="ultrafast", g=60, acodec="aac",
+    ))
+
+
+class UserSession:
+    def __init__(self, client, user_id: str, token: str):
+        self.client = client
+        self.user_id = user_id
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    async def run(self, text: str, args) -> dict:
+        timings = {}
+        started = time.perf_counter()
+        response = await self.client.post("/uploads/generateBrainrot", headers=self.headers, json={
+            "folder_id": None,
+            "text": text,
+            "audio_options": {"voice": "alloy", "split_sentences": args.split_sentences},
+            "subtitle_options": {"Karaoke": True},
+            "subtitle_mode": args.subtitle_mode,
+        })
+        response.raise_for_status()
+        job = response.json()
+
+        while job["status"] not in ("completed", "failed"):
+            await asyncio.sleep(0.05)
+            response = await self.client.get(f"/uploads/jobs/{job['_id']}", headers=self.headers)
+            response.raise_for_status()
+            job = response.json()
+        if job["status"] == "failed":
+            raise RuntimeError(f"Job failed: {job['error']}")
+        timings["job"] = time.perf_counter() - started
+
+        mark = time.perf_counter()
+        response = await self.client.get(job["result"]["url"], headers=self.headers)
+        response.raise_for_status()
+        timings["result_zip"] = time.perf_counter() - mark
+
+        mark = time.perf_counter()
+        response = await self.client.post("/uploads/generateDownload", headers=self.headers, json={
+            "folder_id": job["result"]["folder_id"],
+            "video_options": {"profile": args.profile},
+        })
+        response.raise_for_status()
+        timings["download"] = time.perf_counter() - mark
+        timings["end_to_end"] = time.perf_counter() - started
+        timings["folder_id"] = job["result"]["folder_id"]
+        return timings
+
+
+async def run_level(app, sessions, users: int, args) -> list:
+    import httpx
+
+    async def user_loop(session: UserSession, index: int):
+        results = []
+        for job in range(args.jobs):
+            # Different scripts per job, so TTS and render caches don't short-circuit the run
+            text = make_script(args.words, seed=hash((users, index, job, args.seed)))
+            results.append(await session.run(text, args))
+        return results
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for session in sessions[:users]:
+            session.client = client
+        per_user = await asyncio.gather(*(user_loop(session, i) for i, session in enumerate(sessions[:users])))
+    return [result for results in per_user for result in results]
+
+
+async def main(args):
+    import mongomock_motor
+
+    from benchmarks.stub_tts_server import serve
+    tts_server = serve(args.tts_port, latency=args.tts_latency)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.tts_port}/v1"
+
+    import server.database as database
+    database.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+    # mongomock ignores partialFilterExpression, so every user without a Google sub would collide
+    from server.models.user import User
+    User.Settings.indexes = [index for index in User.Settings.indexes if "sub" not in index.document["key"]]
+
+    from server.app import app
+    from server.auth.auth_handler import sign_jwt
+    from server.database import create_user, set_user_credit
+    from server.rate_limiter import limiter
+    from server.schemas.user import UserRegisterSchema
+    from server.utils.background_library import background_library
+    from server.utils.text_to_speech import tts_cache
+    from server.utils.video_proccessing import render_cache
+
+    # Every simulated user comes from the same address
+    limiter.enabled = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        backgrounds = tmp / "backgrounds"
+        backgrounds.mkdir()
+        print(f"Generating a {args.background_seconds:.0f}s background video...")
+        await make_background(backgrounds / "synthetic.mp4", args.background_seconds)
+        background_library.root = backgrounds
+        background_library.manifest_path = backgrounds / ".manifest.json"
+        tts_cache.root = tmp / "tts_cache"
+        render_cache.root = tmp / "render_cache"
+
+        folders = []
+        async with app.router.lifespan_context(app):
+            sessions = []
+            for i in range(max(args.users)):
+                user = await create_user(UserRegisterSchema(
+                    username=f"benchmark{i}", email=f"benchmark{i}@example.com",
+                    password="benchmark-password", confirm_password="benchmark-password",
+                ))
+                await set_user_credit(user.id, 10 ** 6)
+                sessions.append(UserSession(None, user.id, sign_jwt(user.id)["access_token"]))
+
+            print(f"{args.jobs} job(s) per user, {args.words} words per script, {args.subtitle_mode} subtitles, {args.profile} profile")
+            for users in args.users:
+                stages_before, usage_before = stage_snapshot(), usage()
+                started = time.perf_counter()
+                results = await run_level(app, sessions, users, args)
+                elapsed = time.perf_counter() - started
+                stages_after, usage_after = stage_snapshot(), usage()
+                folders += [result["folder_id"] for result in results]
+
+                print(f"\n{users} concurrent user(s): {len(results)} jobs in {elapsed:.2f}s, "
+                      f"{len(results) / elapsed * 60:.1f} jobs/min")
+                print(f"  {'phase':<18}{'p50 s':>10}{'p95 s':>10}{'max s':>10}")
+                for phase in ("job", "result_zip", "download", "end_to_end"):
+                    values = [result[phase] for result in results]
+                    print(f"  {phase:<18}{percentile(values, 0.5):>10.3f}{percentile(values, 0.95):>10.3f}{max(values):>10.3f}")
+                stage_report(stages_before, stages_after)
+                print(
+                    f"  cpu: {usage_after[0] - usage_before[0]:.1f}s server, {usage_after[1] - usage_before[1]:.1f}s ffmpeg; "
+                    f"peak rss: {usage_after[2] / 2 ** 20:.0f} MiB server, {usage_after[3] / 2 ** 20:.0f} MiB largest ffmpeg"
+                )
+
+        tts_server.shutdown()
+        if not args.keep:
+            uploads = Path(os.getcwd()) / "static" / "uploads"
+            for folder_id in folders:
+                shutil.rmtree(uploads / folder_id, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4], help="Concurrency levels to run, in order")
+    parser.add_argument("--jobs", type=int, default=2, help="Jobs each user runs one after another")
+    parser.add_argument("--words", type=int, default=120, help="Words per script")
+    parser.add_argument("--subtitle-mode", choices=["align", "transcribe"], default="align")
+    parser.add_argument("--profile", choices=["draft", "standard", "high"], default="draft")
+    parser.add_argument("--split-sentences", action="store_true")
+    parser.add_argument("--background-seconds", type=float, default=120)
+    parser.add_argument("--tts-port", type=int, default=8089)
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="Seconds the stub waits before answering")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the generated upload folders")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,112 @@
+"""
+Local stand-in for the OpenAI speech endpoint (POST /v1/audio/speech).
+
+Speech is synthesized as a tone per word with short pauses between words and longer
+ones after sentences, so it has a realistic duration and silences for chunking and
+alignment. Point the backend at it with:
+
+    python -m benchmarks.stub_tts_server --port 8089
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub uvicorn server.app:app
+"""
+import argparse
+import io
+import json
+import re
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+SAMPLE_RATE = 24000  # Same as OpenAI TTS output
+SECONDS_PER_CHAR = 0.055
+WORD_PAUSE = 0.08
+SENTENCE_PAUSE = 0.35
+
+
+def synthesize_pcm(text: str) -> bytes:
+    """16-bit mono PCM at 24 kHz, like `response_format="pcm"`."""
+    parts = []
+    for i, word in enumerate(text.split()):
+        n = np.arange(int(len(word) * SECONDS_PER_CHAR * SAMPLE_RATE))
+        envelope = np.minimum(1.0, np.minimum(n, len(n) - n) / 240)
+        frequency = 180 + (i % 5) * 40
+        parts.append(12000 * envelope * np.sin(2 * np.pi * frequency * n / SAMPLE_RATE))
+        pause = SENTENCE_PAUSE if re.search(r"[.!?]$", word) else WORD_PAUSE
+        parts.append(np.zeros(int(pause * SAMPLE_RATE)))
+    if not parts:
+        return b""
+    return np.concatenate(parts).astype("<i2").tobytes()
+
+
+def to_wav(pcm: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class SpeechHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connection reuse is exercised
+    latency = 0.0  # Seconds before the first byte, to mimic the real API
+    fail_every = 0  # Answer every n-th request with a 500 to exercise retries
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/audio/speech"):
+            return self.reply(404, b'{"error": {"message": "Not found"}}', "application/json")
+
+        with self.lock:
+            SpeechHandler.requests += 1
+            fail = self.fail_every and SpeechHandler.requests % self.fail_every == 0
+        if fail:
+            return self.reply(500, b'{"error": {"message": "Stub failure"}}', "application/json")
+
+        time.sleep(self.latency)
+        pcm = synthesize_pcm(body.get("input", ""))
+        if body.get("response_format", "mp3") == "pcm":
+            self.reply(200, pcm, "audio/pcm")
+        else:
+            self.reply(200, to_wav(pcm), "audio/wav")
+
+    def reply(self, status: int, payload: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(payload), 16 * 1024):
+            chunk = payload[start:start + 16 * 1024]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = 8089, latency: float = 0.0, fail_every: int = 0) -> ThreadingHTTPServer:
+    """Starts the stub on a background thread and returns the server, call `shutdown()` to stop it."""
+    SpeechHandler.latency = latency
+    SpeechHandler.fail_every = fail_every
+    server = ThreadingHTTPServer(("127.0.0.1", port), SpeechHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+    server = serve(args.port, args.latency, args.fail_every)
+    print(f"Stub TTS listening on http://127.0.0.1:{args.port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
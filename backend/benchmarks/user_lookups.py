@@ -0,0 +1,156 @@
+"""
+Seeds a users collection and measures the lookups done on every login, registration
+and authenticated request, without and with the indexes declared on `User`.
+
+Needs a MongoDB server; a separate database is used and kept between runs, so the
+seed only happens once. Run it from backend/:
+
+    python -m benchmarks.user_lookups --mongo-uri mongodb://localhost:27017 --users 1000000
+    python -m benchmarks.user_lookups --users 1000000 --lookups 2000 --reseed
+
+For every lookup it reports latency percentiles and the plan MongoDB chose (COLLSCAN
+or IXSCAN), for whole documents and for the `UserFields` projection the app uses.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+
+from beanie import init_beanie
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from server import database
+from server.models.user import User
+from server.schemas.user import UserRegisterSchema
+
+BATCH_SIZE = 10000
+GOOGLE_EVERY = 4  # Every 4th seeded user signed up with Google and has a sub
+
+
+def seeded_user(i: int) -> dict:
+    return {
+        "username": f"user{i:07d}",
+        "email": f"user{i:07d}@example.com",
+        "password": "0" * 64,
+        "sub": f"google-{i:07d}" if i % GOOGLE_EVERY == 0 else None,
+        "credit": 50,
+        "picture": None,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+async def seed(collection, users: int):
+    started = time.perf_counter()
+    for first in range(0, users, BATCH_SIZE):
+        batch = [seeded_user(i) for i in range(first, min(first + BATCH_SIZE, users))]
+        await collection.insert_many(batch, ordered=False)
+        print(f"\r  {first + len(batch)}/{users} users", end="", flush=True)
+    print(f"\n  seeded in {time.perf_counter() - started:.1f}s")
+
+
+async def winning_stage(collection, query: dict) -> str:
+    plan = (await collection.find(query).limit(1).explain())["queryPlanner"]["winningPlan"]
+    # Descend to the stage that reads the data, past FETCH / LIMIT / PROJECTION
+    while "inputStage" in plan:
+        plan = plan["inputStage"]
+    return plan.get("stage", "?")
+
+
+async def measure(name: str, lookup, values, collection, query_for):
+    timings = []
+    for value in values:
+        started = time.perf_counter()
+        found = await lookup(value)
+        timings.append((time.perf_counter() - started) * 1000)
+        if found is None:
+            raise RuntimeError(f"{name} found nothing for {value}")
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95)]
+    stage = await winning_stage(collection, query_for(values[0]))
+    print(f"  {name:<28}{statistics.median(timings):>10.3f}{p95:>10.3f}{timings[-1]:>10.3f}  {stage}")
+
+
+async def run_lookups(collection, users: int, lookups: int, seed: int):
+    rng = random.Random(seed)
+    indices = [rng.randrange(users) for _ in range(lookups)]
+    google = [i - i % GOOGLE_EVERY for i in indices]
+    emails = [f"user{i:07d}@example.com" for i in indices]
+    usernames = [f"user{i:07d}" for i in indices]
+    subs = [f"google-{i:07d}" for i in google]
+    ids = [str(document["_id"]) for document in await collection.aggregate(
+        [{"$sample": {"size": lookups}}, {"$project": {"_id": 1}}]
+    ).to_list(None)]
+
+    async def whole_document(query: dict):
+        return await User.find_one(query)
+
+    print(f"  {'lookup':<28}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}  plan")
+    await measure("by email (document)", lambda v: whole_document({"email": v}), emails, collection, lambda v: {"email": v})
+    await measure("get_user_by_email", database.get_user_by_email, emails, collection, lambda v: {"email": v})
+    await measure("get_user_by_username", database.get_user_by_username, usernames, collection, lambda v: {"username": v})
+    await measure("get_user_by_sub", database.get_user_by_sub, subs, collection, lambda v: {"sub": v})
+    await measure("get_user", database.get_user, ids, collection, lambda v: {"_id": ObjectId(v)})
+
+
+async def measure_duplicate_registration(lookups: int):
+    # A taken email is now caught by the unique index on insert, not by two finds before it
+    timings = []
+    for i in range(lookups):
+        started = time.perf_counter()
+        try:
+            await database.create_user(UserRegisterSchema(
+                username=f"newuser{i}", email="user0000000@example.com",
+                password="benchmark-password", confirm_password="benchmark-password",
+            ))
+        except Exception:
+            pass
+        else:
+            raise RuntimeError("Registering a taken email succeeded")
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(f"  {'create_user, taken email':<28}{statistics.median(timings):>10.3f}{timings[int(len(timings) * 0.95)]:>10.3f}{timings[-1]:>10.3f}")
+
+
+async def main(args):
+    client = AsyncIOMotorClient(args.mongo_uri)
+    db = client[args.database]
+    await init_beanie(db, document_models=[User])
+    collection = User.get_motor_collection()
+
+    if args.reseed:
+        await collection.drop()
+    count = await collection.estimated_document_count()
+    if 0 < count < args.users:
+        raise SystemExit(f"{collection.name} has only {count} users, run with --reseed")
+    if not count:
+        print(f"Seeding {args.users} users into {args.database}.{collection.name}...")
+        # Bulk inserts are faster without indexes to maintain
+        await collection.drop_indexes()
+        await seed(collection, args.users)
+
+    print(f"\nWithout indexes, {args.users} users, {args.scan_lookups} lookups each:")
+    await collection.drop_indexes()
+    await run_lookups(collection, args.users, args.scan_lookups, args.seed)
+
+    started = time.perf_counter()
+    await init_beanie(db, document_models=[User])  # Creates the indexes declared on User
+    print(f"\nIndexes built in {time.perf_counter() - started:.1f}s")
+    print(f"With indexes, {args.users} users, {args.lookups} lookups each:")
+    await run_lookups(collection, args.users, args.lookups, args.seed)
+    await measure_duplicate_registration(min(args.lookups, 200))
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="brainrot_benchmark")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=1000, help="Lookups per query with indexes")
+    parser.add_argument("--scan-lookups", type=int, default=20, help="Lookups per query without indexes, each scans the collection")
+    parser.add_argument("--reseed", action="store_true", help="Drop and seed the collection again")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -1,5 +1,5 @@
 # main.py
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
@@ -9,19 +9,31 @@ from starlette.responses import RedirectResponse
 
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
 import os
 
 from server.rate_limiter import limiter
+from server.metrics import render_metrics, require_metrics_token
 from server.database import db
+from server.job_queue import job_queue
+from server.utils.transcription import transcription_service
+from server.utils.hashing import password_hasher
+from server.utils.background_library import background_library
+from server.utils.text_to_speech import close_client as close_tts_client
 from server.routes.user import user_router
 from server.routes.upload import upload_router
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await db.connect()
+    await background_library.load()
+    await job_queue.start()
     yield
+    await job_queue.stop()
+    transcription_service.shutdown()
+    password_hasher.shutdown()
+    await close_tts_client()
     await db.close()
 
 
@@ -43,9 +55,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "Content-Location", "Content-Range", "ETag"],
 )
 
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
     return RedirectResponse(url="/")
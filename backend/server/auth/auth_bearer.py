@@ -1,12 +1,19 @@
-from fastapi import Request, HTTPException
+from dataclasses import dataclass
+
+from fastapi import Depends, Request, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from .auth_handler import decode_jwt
+from server.database import get_cached_user
+from server.models.user import UserReturn
 from authlib.integrations.starlette_client import OAuth
 from fastapi.security import OAuth2PasswordBearer
 
 import os
 
+# Users allowed to list and export all users, comma separated
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
 oauth = OAuth()
 CONF_URL = "https://accounts.google.com/.well-known/openid-configuration"
 oauth.register(
@@ -25,19 +32,24 @@ oauth.register(
         "prompt": "select_account",  # force to select account
     },
 )
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated caller, from a JWT decoded once per request."""
+
+    user_id: str
+    token: str
+    claims: dict
+
+
 class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
         super(JWTBearer, self).__init__(auto_error=auto_error)
 
-    async def __call__(self, request: Request):
+    async def __call__(self, request: Request) -> Principal:
         # First, check for a token in the cookies
         jwt_token = request.cookies.get('jwt')
         if jwt_token:
-            if not self.verify_jwt(jwt_token):
-                raise HTTPException(
-                    status_code=403, detail="Invalid token or expired token in cookies."
-                )
-            return jwt_token
+            return self.authenticate(jwt_token, "Invalid token or expired token in cookies.")
         
         # If no token in cookies, check headers for JWT token
         credentials: HTTPAuthorizationCredentials = await super(JWTBearer, self).__call__(request)
@@ -47,28 +59,34 @@ class JWTBearer(HTTPBearer):
                 raise HTTPException(
                     status_code=403, detail="Invalid authentication scheme."
                 )
-            if not self.verify_jwt(credentials.credentials):
-                raise HTTPException(
-                    status_code=403, detail="Invalid token or expired token."
-                )
-            return credentials.credentials
-        
-        
-
-        user_data = await oauth.google.parse_id_token(request)
-        if user_data:
-            return user_data  # Return Google user info
+            return self.authenticate(credentials.credentials, "Invalid token or expired token.")
 
         raise HTTPException(status_code=403, detail="Invalid authorization code.")
 
-    def verify_jwt(self, jwtoken: str) -> bool:
-        isTokenValid: bool = False
-
+    def authenticate(self, jwtoken: str, error: str) -> Principal:
         try:
             payload = decode_jwt(jwtoken)
-        except:
+        except Exception:
             payload = None
-        if payload:
-            isTokenValid = True
+        if not payload or "user_id" not in payload:
+            raise HTTPException(status_code=403, detail=error)
+        return Principal(user_id=payload["user_id"], token=jwtoken, claims=payload)
+
+
+# Depend on this one instance: FastAPI caches a dependency per request by its callable,
+# so the token is decoded once however many times a route and its helpers ask for it
+jwt_bearer = JWTBearer()
+
+
+async def get_current_user(principal: Principal = Depends(jwt_bearer)) -> UserReturn:
+    """The authenticated user, from the short-lived user cache."""
+    user = await get_cached_user(principal.user_id)
+    if not user:
+        raise HTTPException(status_code=400, detail="User not found")
+    return user
+
 
-        return isTokenValid
+async def require_admin(user: UserReturn = Depends(get_current_user)) -> UserReturn:
+    if user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
@@ -1,15 +1,20 @@
 # database.py
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Set, Tuple
 from fastapi import HTTPException
 
-from server.models.user import User, UserReturn
+from server.models.user import User, UserFields, UserId, UserKeys, UserReturn
+from server.models.job import Job
+from server.models.credit import CreditTransaction
 from server.utils.hashing import hash_password
 from server.schemas.user import UserRegisterSchema, UserGoogleRegisterSchema
 
-import os, random
+import asyncio, os, random, re, time
+from collections import OrderedDict
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 
 class Database:
@@ -24,35 +29,121 @@ class Database:
         self.db = self.client[self.db_name]
 
         # Initialize Beanie models
-        await init_beanie(self.db, document_models=[User])
+        await init_beanie(self.db, document_models=[User, Job, CreditTransaction])
 
     async def close(self):
+        await credit_ledger.drain()
         self.client.close()
 
 
+class UserCache:
+    """
+    Short-lived in-process cache of users by id, for the authenticated endpoints that
+    the frontend polls. Writes through this module invalidate their user; other worker
+    processes see a change after at most `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._users: "OrderedDict[str, tuple]" = OrderedDict()  # user_id -> (expires, UserReturn)
+
+    def get(self, user_id: str) -> Optional[UserReturn]:
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._users[user_id]
+            return None
+        return entry[1]
+
+    def set(self, user: UserReturn):
+        self._users[user.id] = (time.monotonic() + self.ttl, user)
+        self._users.move_to_end(user.id)
+        while len(self._users) > self.max_entries:
+            self._users.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        self._users.pop(str(user_id), None)
+
+
+class CreditLedger:
+    """
+    Records credit transactions in the background, so charging a user stays a single
+    round-trip. A failed write is logged and never undoes the credit change itself.
+    """
+
+    def __init__(self):
+        self.pending: Set[asyncio.Task] = set()
+
+    def record(self, user_id: str, amount: int, balance: int, reason: str, reference: Optional[str] = None):
+        transaction = CreditTransaction(
+            user_id=str(user_id), amount=amount, balance=balance, reason=reason, reference=reference,
+        )
+        task = asyncio.create_task(self._insert(transaction))
+        # Keep a reference until the insert is done, asyncio only holds weak ones
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def _insert(self, transaction: CreditTransaction):
+        try:
+            await transaction.insert()
+        except Exception as e:
+            print(f"Error recording credit transaction {transaction.model_dump()}: {e}")
+
+    async def drain(self):
+        """Waits for the transactions still being written, e.g. on shutdown."""
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+
+
 # Initialize the database connection
 db = Database(db_url=os.getenv("MONGO_URI"), db_name="brainrot")
+user_cache = UserCache(ttl=float(os.getenv("USER_CACHE_TTL", 30)))
+credit_ledger = CreditLedger()
+
+# Never the password hash
+USER_EXPORT_FIELDS = {"username": True, "email": True, "credit": True, "picture": True, "sub": True, "created_at": True}
+
+
+def duplicate_field(error: DuplicateKeyError) -> Optional[str]:
+    """The field of the unique index a write was rejected by, e.g. "email"."""
+    key_pattern = (error.details or {}).get("keyPattern")
+    if key_pattern:
+        return next(iter(key_pattern))
+    match = re.search(r"index: (\w+?)_-?1", str(error))
+    return match.group(1) if match else None
+
+
+def duplicate_user_error(error: DuplicateKeyError) -> HTTPException:
+    field = duplicate_field(error)
+    detail = f"User with that {field} already exists" if field else "User already exists"
+    return HTTPException(status_code=400, detail=detail)
 
 
 # User creation logic for standard registration
 async def create_user(user_data: UserRegisterSchema) -> UserReturn:
-    if await get_user_by_email(user_data.email):
-        raise HTTPException(
-            status_code=400, detail="User with that email already exists"
-        )
-    if await get_user_by_username(user_data.username):
-        raise HTTPException(
-            status_code=400, detail="User with that username already exists"
-        )
     if not validate_username(user_data.username):
         raise HTTPException(status_code=400, detail="Invalid username format")
+
+    # One indexed lookup before hashing, so a taken email or username doesn't cost a
+    # full scrypt; the unique indexes still catch registrations racing past it
+    existing_user = await User.find_one(
+        {"$or": [{"email": user_data.email}, {"username": user_data.username}]}
+    ).project(UserKeys)
+    if existing_user:
+        field = "email" if existing_user.email == user_data.email else "username"
+        raise HTTPException(status_code=400, detail=f"User with that {field} already exists")
     
     user_data.password = await hash_password(user_data.password)
     
     user = User(
         username=user_data.username, email=user_data.email, password=user_data.password
     )
-    await user.insert()
+    try:
+        await user.insert()
+    except DuplicateKeyError as e:
+        raise duplicate_user_error(e)
     return UserReturn.from_document(user)
 
 
@@ -60,47 +151,88 @@ async def create_user_google(user_data: UserGoogleRegisterSchema) -> UserReturn:
     # Check if the user already exists based on the email or Google sub
     existing_user = await get_user_by_email(user_data.email)
     if existing_user:
-        return UserReturn.from_document(existing_user)
-
-    # Optional: Automatically generate a username if none is provided
-    username = generate_username(user_data.email) + str(random.randint(1000, 9999))
-    # Ensure the username is unique
-    if await get_user_by_username(username):
-        raise HTTPException(status_code=400, detail="Username already taken")
-    # Create new user
-    user = User(
-        username=username,
-        email=user_data.email,
-        sub=user_data.sub,
-        picture=user_data.picture,
-    )
-    await user.insert()
-    return UserReturn.from_document(user)
+        return existing_user
+
+    # Optional: Automatically generate a username if none is provided,
+    # with another random suffix while the username is taken
+    for _ in range(5):
+        username = generate_username(user_data.email) + str(random.randint(1000, 9999))
+        user = User(
+            username=username,
+            email=user_data.email,
+            sub=user_data.sub,
+            picture=user_data.picture,
+        )
+        try:
+            await user.insert()
+            return UserReturn.from_document(user)
+        except DuplicateKeyError as e:
+            field = duplicate_field(e)
+            if field == "username":
+                continue
+            # Signed up in another request meanwhile, or the Google account's email changed
+            existing_user = await (get_user_by_sub(user_data.sub) if field == "sub" else get_user_by_email(user_data.email))
+            if existing_user:
+                return existing_user
+            raise duplicate_user_error(e)
+    raise HTTPException(status_code=400, detail="Username already taken")
 
 
 async def get_user(user_id: str) -> Optional[UserReturn]:
-    user = await User.find_one({"_id": ObjectId(user_id)})
+    user = await User.find_one({"_id": ObjectId(user_id)}).project(UserFields)
     return UserReturn.from_document(user) if user else None
 
 
+async def get_cached_user(user_id: str) -> Optional[UserReturn]:
+    """Like `get_user`, served from `user_cache` for up to USER_CACHE_TTL seconds."""
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await get_user(user_id)
+        if user is not None:
+            user_cache.set(user)
+    return user
+
+
 async def get_user_by_email(email: str) -> Optional[UserReturn]:
-    user = await User.find_one({"email": email})
+    user = await User.find_one({"email": email}).project(UserFields)
     return UserReturn.from_document(user) if user else None
 
 
 async def get_user_by_sub(sub: str) -> Optional[UserReturn]:
-    user = await User.find_one({"sub": sub})
+    user = await User.find_one({"sub": sub}).project(UserFields)
     return UserReturn.from_document(user) if user else None
 
 
 async def get_user_by_username(username: str) -> Optional[UserReturn]:
-    user = await User.find_one({"username": username})
+    user = await User.find_one({"username": username}).project(UserFields)
     return UserReturn.from_document(user) if user else None
 
 
-async def get_users() -> List[UserReturn]:
-    users = await User.all().to_list()
-    return [UserReturn.from_document(user) for user in users]
+async def get_users(limit: int = 100, after: Optional[str] = None) -> Tuple[List[UserReturn], Optional[str]]:
+    """
+    A page of users in `_id` order. Pages are found through the `_id` index from the
+    last id of the previous one, so every page costs the same however deep it is.
+
+    :param after: Id of the last user of the previous page, None for the first page.
+    :return: The users and the `after` of the next page, None if this is the last one.
+    """
+    query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+    # One extra user tells whether there is a next page
+    users = await User.find(query).sort("_id").limit(limit + 1).project(UserFields).to_list()
+    next_after = str(users[limit - 1].id) if len(users) > limit else None
+    return [UserReturn.from_document(user) for user in users[:limit]], next_after
+
+
+async def iter_users(batch_size: int = 1000) -> AsyncIterator[dict]:
+    """
+    Every user as a raw document with the exported fields, read from one cursor in
+    batches of `batch_size`, so memory does not grow with the collection.
+    """
+    cursor = User.get_motor_collection().find(
+        {}, projection=USER_EXPORT_FIELDS, sort=[("_id", 1)], batch_size=batch_size,
+    )
+    async for document in cursor:
+        yield document
 
 
 async def update_user(user_id: str, user_data: UserRegisterSchema) -> UserReturn:
@@ -114,33 +246,93 @@ async def update_user(user_id: str, user_data: UserRegisterSchema) -> UserReturn
         user.email = user_data.email
     if user_data.password:
         user.password = await hash_password(user_data.password)
-    await user.save()
+    try:
+        await user.save()
+    except DuplicateKeyError as e:
+        raise duplicate_user_error(e)
+    user_cache.invalidate(user_id)
     return UserReturn.from_document(user)
 
 
+async def upgrade_password_hash(user_id: str, old_hash: str, new_hash: str) -> bool:
+    """
+    Replaces a legacy or weaker password hash after a successful login. Only matches
+    while the old hash is still stored, so a password changed meanwhile is kept.
+    """
+    result = await User.get_motor_collection().update_one(
+        {"_id": ObjectId(user_id), "password": old_hash},
+        {"$set": {"password": new_hash}},
+    )
+    if result.modified_count:
+        user_cache.invalidate(user_id)
+    return bool(result.modified_count)
+
+
 async def delete_user(user_id: str) -> bool:
     user = await User.get(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     await user.delete()
+    user_cache.invalidate(user_id)
     return True
 
 async def set_user_credit(user_id: str, credit: int) -> UserReturn:
     user = await User.find_one({"_id": ObjectId(user_id)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    previous = user.credit or 0
     user.credit = credit
     await user.save()
+    user_cache.invalidate(user_id)
+    credit_ledger.record(user_id, credit - previous, credit, "set")
     return UserReturn.from_document(user)
 
-async def deduct_user_credit(user_id: str, amount: int) -> UserReturn:
-    user = await User.find_one({"_id": ObjectId(user_id)})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    user.credit -= amount
-    await user.save()
-    return UserReturn.from_document(user)
+
+async def reserve_credit(user_id: str, amount: int, reason: str, reference: Optional[str] = None) -> int:
+    """
+    Takes `amount` credits from the user in a single conditional update, which only
+    matches while the user still has that many, so concurrent requests cannot spend
+    the same credits twice. Give them back with `refund_credit` if the work fails.
+
+    :param reason: What the credits pay for, recorded in the ledger.
+    :param reference: Folder or job the credits pay for, recorded in the ledger.
+    :return: The credit left.
+    """
+    user = await User.get_motor_collection().find_one_and_update(
+        {"_id": ObjectId(user_id), "credit": {"$gte": amount}},
+        {"$inc": {"credit": -amount}},
+        projection={"credit": True},
+        return_document=ReturnDocument.AFTER,
+    )
+    if user is None:
+        # Only a refused reservation pays for telling the two cases apart
+        if not await User.find_one({"_id": ObjectId(user_id)}).project(UserId):
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=400, detail="Insufficient credits to process video")
+    user_cache.invalidate(user_id)
+    credit_ledger.record(user_id, -amount, user["credit"], reason, reference)
+    return user["credit"]
+
+
+async def refund_credit(user_id: str, amount: int, reference: Optional[str] = None) -> Optional[int]:
+    """
+    Gives back credits taken by `reserve_credit` for work that failed.
+
+    :return: The credit after the refund, or None if the user no longer exists.
+    """
+    user = await User.get_motor_collection().find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        {"$inc": {"credit": amount}},
+        projection={"credit": True},
+        return_document=ReturnDocument.AFTER,
+    )
+    if user is None:
+        return None
+    user_cache.invalidate(user_id)
+    credit_ledger.record(user_id, amount, user["credit"], "refund", reference)
+    return user["credit"]
+
 
 def validate_username(username: str) -> bool:
     """
@@ -0,0 +1,352 @@
+# job_queue.py
+import asyncio
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from server import metrics
+from server.database import refund_credit
+from server.models.job import Job, JobReturn, JobStatus
+from server.utils.pipeline import generate_brainrot, restyle_brainrot
+
+ProgressCallback = Callable[[str, float], Awaitable[None]]
+JobHandler = Callable[[JobReturn, ProgressCallback], Awaitable[Dict[str, Any]]]
+
+
+class MemoryJobStore:
+    """In-process job store, used for tests and single-process development."""
+
+    def __init__(self):
+        self.jobs: Dict[str, JobReturn] = {}
+
+    async def create(self, job: JobReturn) -> JobReturn:
+        job = job.model_copy(update={"id": uuid.uuid4().hex})
+        self.jobs[job.id] = job
+        return job
+
+    async def get(self, job_id: str) -> Optional[JobReturn]:
+        return self.jobs.get(job_id)
+
+    async def update(self, job_id: str, **fields) -> JobReturn:
+        job = self.jobs[job_id].model_copy(update=fields)
+        self.jobs[job_id] = job
+        return job
+
+    async def claim(self, job_id: str, owner: str, now: datetime) -> Optional[JobReturn]:
+        job = self.jobs.get(job_id)
+        if job is None or job.status != JobStatus.queued:
+            return None
+        return await self.update(
+            job_id, status=JobStatus.running, stage="starting", progress=0.0, owner=owner, heartbeat_at=now, updated_at=now,
+        )
+
+    async def heartbeat(self, owner: str, job_ids: List[str], now: datetime):
+        for job_id in job_ids:
+            job = self.jobs.get(job_id)
+            if job is not None and job.owner == owner and job.status == JobStatus.running:
+                await self.update(job_id, heartbeat_at=now)
+
+    async def fail_stale(self, before: datetime, error: str) -> List[JobReturn]:
+        failed = []
+        for job in list(self.jobs.values()):
+            if job.status == JobStatus.running and (job.heartbeat_at is None or job.heartbeat_at < before):
+                failed.append(await self.update(job.id, status=JobStatus.failed, error=error, updated_at=datetime.now(timezone.utc)))
+        return failed
+
+    async def queued(self) -> List[JobReturn]:
+        return [job for job in self.jobs.values() if job.status == JobStatus.queued]
+
+    async def mark_refunded(self, job_id: str) -> bool:
+        if self.jobs[job_id].refunded:
+            return False
+        await self.update(job_id, refunded=True)
+        return True
+
+
+class MongoJobStore:
+    """Persists jobs in the `jobs` collection next to `users`."""
+
+    async def create(self, job: JobReturn) -> JobReturn:
+        document = Job(**job.model_dump(exclude={"id"}))
+        await document.insert()
+        return JobReturn.from_document(document)
+
+    async def get(self, job_id: str) -> Optional[JobReturn]:
+        if not ObjectId.is_valid(job_id):
+            return None
+        document = await Job.get(ObjectId(job_id))
+        return JobReturn.from_document(document) if document else None
+
+    async def update(self, job_id: str, **fields) -> JobReturn:
+        document = await Job.get(ObjectId(job_id))
+        await document.set(fields)
+        return JobReturn.from_document(document)
+
+    async def claim(self, job_id: str, owner: str, now: datetime) -> Optional[JobReturn]:
+        """Moves the job from queued to running for `owner`, unless another process got there first."""
+        document = await Job.get_motor_collection().find_one_and_update(
+            {"_id": ObjectId(job_id), "status": JobStatus.queued.value},
+            {"$set": {
+                "status": JobStatus.running.value, "stage": "starting", "progress": 0.0,
+                "owner": owner, "heartbeat_at": now, "updated_at": now,
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+        return JobReturn.from_document(Job.model_validate(document)) if document else None
+
+    async def heartbeat(self, owner: str, job_ids: List[str], now: datetime):
+        """Refreshes the heartbeat of the given jobs, if `owner` still runs them."""
+        if not job_ids:
+            return
+        await Job.get_motor_collection().update_many(
+            {"_id": {"$in": [ObjectId(job_id) for job_id in job_ids]}, "owner": owner, "status": JobStatus.running.value},
+            {"$set": {"heartbeat_at": now}},
+        )
+
+    async def fail_stale(self, before: datetime, error: str) -> List[JobReturn]:
+        """Fails the running jobs whose owner stopped sending heartbeats before `before`."""
+        stale = {"status": JobStatus.running.value, "$or": [{"heartbeat_at": {"$lt": before}}, {"heartbeat_at": None}]}
+        failed = []
+        for document in await Job.find(stale).to_list():
+            # Conditional, the owner may have come back since the find
+            document = await Job.get_motor_collection().find_one_and_update(
+                {"_id": document.id, **stale},
+                {"$set": {"status": JobStatus.failed.value, "error": error, "updated_at": datetime.now(timezone.utc)}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if document:
+                failed.append(JobReturn.from_document(Job.model_validate(document)))
+        return failed
+
+    async def queued(self) -> List[JobReturn]:
+        documents = await Job.find({"status": JobStatus.queued.value}).sort("created_at").to_list()
+        return [JobReturn.from_document(document) for document in documents]
+
+    async def mark_refunded(self, job_id: str) -> bool:
+        """Flags the job as refunded, False if it already was, so a refund happens at most once."""
+        result = await Job.get_motor_collection().update_one(
+            {"_id": ObjectId(job_id), "refunded": {"$ne": True}},
+            {"$set": {"refunded": True}},
+        )
+        return result.modified_count == 1
+
+
+class JobQueue:
+    """
+    Runs pipeline jobs on a fixed pool of asyncio workers.
+
+    Pending jobs are kept in one FIFO per user and workers pick users round-robin,
+    so a user submitting many jobs cannot starve everybody else. At most
+    `max_per_user` jobs of the same user run at once.
+
+    Several processes can share one store: a job is claimed atomically before it runs,
+    and its owner refreshes a heartbeat every `heartbeat_interval` seconds. Running jobs
+    whose heartbeat is older than `stale_after` seconds lost their process and are failed.
+    Only jobs a worker is still running get a heartbeat, so a job whose final update
+    could not be saved goes stale and is failed and refunded like an interrupted one.
+    """
+
+    def __init__(self, store, handlers: Dict[str, JobHandler], max_workers: int = 2, max_per_user: int = 1, poll_interval: float = 2.0,
+                 heartbeat_interval: float = 15.0, stale_after: float = 60.0, finish_attempts: int = 3):
+        self.store = store
+        self.handlers = handlers
+        self.max_workers = max_workers
+        self.max_per_user = max_per_user
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.finish_attempts = finish_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pending: "OrderedDict[str, Deque[str]]" = OrderedDict()
+        self._running: Dict[str, int] = defaultdict(int)
+        self._condition = asyncio.Condition()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._workers: List[asyncio.Task] = []
+        self._active: Set[str] = set()  # Jobs claimed by this process and still running
+
+    async def start(self):
+        await self._fail_stale()
+        # Other processes may enqueue the same jobs, whoever claims one first runs it
+        for job in await self.store.queued():
+            if job.id not in self._pending.get(job.user_id, ()):
+                await self._enqueue(job)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        self._workers.append(asyncio.create_task(self._keep_alive()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.store.heartbeat(self.owner, list(self._active), datetime.now(timezone.utc))
+                await self._fail_stale()
+            except Exception as e:
+                print(f"Error sending job heartbeat: {e}")
+
+    async def _fail_stale(self):
+        before = datetime.now(timezone.utc) - timedelta(seconds=self.stale_after)
+        for job in await self.store.fail_stale(before, "Job interrupted before it could finish"):
+            self._publish(job)
+            await self._refund(job)
+
+    async def submit(self, user_id: str, kind: str, folder_id: str, payload: Dict[str, Any], credits: int = 0) -> JobReturn:
+        """
+        :param credits: Credits already reserved for the job, refunded to the user if it fails.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = await self.store.create(
+            JobReturn(id="", user_id=user_id, kind=kind, folder_id=folder_id, payload=payload, credits=credits)
+        )
+        await self._enqueue(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[JobReturn]:
+        return await self.store.get(job_id)
+
+    async def subscribe(self, job_id: str) -> AsyncIterator[JobReturn]:
+        """
+        Yields the job's current state and then every update until it finishes.
+
+        Updates made by this process are pushed immediately; the store is re-read every
+        `poll_interval` seconds in case the job runs in another worker process.
+        """
+        updates: asyncio.Queue = asyncio.Queue()
+        self._subscribers[job_id].add(updates)
+        try:
+            job = await self.store.get(job_id)
+            while job is not None:
+                yield job
+                if job.finished:
+                    return
+                try:
+                    job = await asyncio.wait_for(updates.get(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    job = await self.store.get(job_id)
+        finally:
+            self._subscribers[job_id].discard(updates)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    async def _enqueue(self, job: JobReturn):
+        async with self._condition:
+            self._pending.setdefault(job.user_id, deque()).append(job.id)
+            metrics.jobs_waiting.inc()
+            self._condition.notify()
+
+    def _next_job(self) -> Optional[tuple]:
+        for user_id in list(self._pending):
+            if self._running.get(user_id, 0) >= self.max_per_user:
+                continue
+            queue = self._pending[user_id]
+            job_id = queue.popleft()
+            if queue:
+                # Give the other users a turn before this one's next job
+                self._pending.move_to_end(user_id)
+            else:
+                del self._pending[user_id]
+            self._running[user_id] += 1
+            metrics.jobs_waiting.dec()
+            return user_id, job_id
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                user_id, job_id = await self._condition.wait_for(self._next_job)
+            try:
+                with metrics.jobs_running.track_inprogress():
+                    await self._run(job_id)
+            except Exception as e:
+                # e.g. the store is unreachable, the worker must outlive it
+                print(f"Error running job {job_id}: {e}")
+            finally:
+                async with self._condition:
+                    self._running[user_id] -= 1
+                    if not self._running[user_id]:
+                        del self._running[user_id]
+                    self._condition.notify_all()
+
+    async def _run(self, job_id: str):
+        job = await self.store.claim(job_id, self.owner, datetime.now(timezone.utc))
+        if job is None:
+            return  # Claimed by another process
+        self._active.add(job_id)
+        try:
+            self._publish(job)
+            await self._execute(job)
+        finally:
+            # A job left running from here on gets no heartbeat and is failed as stale
+            self._active.discard(job_id)
+
+    async def _execute(self, job: JobReturn):
+        async def report(stage: str, progress: float):
+            await self._update(job.id, stage=stage, progress=progress)
+
+        started = time.perf_counter()
+        try:
+            result = await self.handlers[job.kind](job, report)
+        except asyncio.CancelledError:
+            await self._finish(job.id, status=JobStatus.failed, error="Job cancelled")
+            await self._refund(job)
+            raise
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            metrics.job_seconds.labels(job.kind, JobStatus.failed.value).observe(time.perf_counter() - started)
+            await self._finish(job.id, status=JobStatus.failed, error=str(e))
+            await self._refund(job)
+        else:
+            metrics.job_seconds.labels(job.kind, JobStatus.completed.value).observe(time.perf_counter() - started)
+            await self._finish(job.id, status=JobStatus.completed, stage="done", progress=1.0, result=result)
+
+    async def _finish(self, job_id: str, **fields) -> JobReturn:
+        """Saves the final state of a job, retrying with a backoff if the store is briefly unreachable."""
+        for attempt in range(self.finish_attempts):
+            try:
+                return await self._update(job_id, **fields)
+            except Exception as e:
+                if attempt == self.finish_attempts - 1:
+                    raise
+                print(f"Error saving the final state of job {job_id}, retrying: {e}")
+                await asyncio.sleep(2 ** attempt)
+
+    async def _refund(self, job: JobReturn):
+        if not job.credits:
+            return
+        try:
+            if await self.store.mark_refunded(job.id):
+                await refund_credit(job.user_id, job.credits, reference=job.folder_id)
+        except Exception as e:
+            print(f"Error refunding {job.credits} credits for job {job.id}: {e}")
+
+    async def _update(self, job_id: str, **fields) -> JobReturn:
+        fields["updated_at"] = datetime.now(timezone.utc)
+        job = await self.store.update(job_id, **fields)
+        self._publish(job)
+        return job
+
+    def _publish(self, job: JobReturn):
+        for updates in self._subscribers.get(job.id, ()):
+            updates.put_nowait(job)
+
+
+job_queue = JobQueue(
+    store=MemoryJobStore() if os.getenv("JOB_BACKEND", "mongo") == "local" else MongoJobStore(),
+    handlers={"generate": generate_brainrot, "restyle": restyle_brainrot},
+    max_workers=int(os.getenv("JOB_WORKERS", 2)),
+    max_per_user=int(os.getenv("JOB_MAX_PER_USER", 1)),
+    heartbeat_interval=float(os.getenv("JOB_HEARTBEAT_INTERVAL", 15)),
+    stale_after=float(os.getenv("JOB_STALE_AFTER", 60)),
+)
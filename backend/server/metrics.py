@@ -0,0 +1,101 @@
+import hmac
+import os
+from contextlib import contextmanager
+
+from fastapi import HTTPException, Request
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+# Bearer token Prometheus scrapes /metrics with, the endpoint is closed without one
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Seconds, from a cache hit up to a long render
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320, 640)
+
+stage_seconds = Histogram(
+    "rotmaxxing_stage_seconds",
+    "Duration of a pipeline stage.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+job_seconds = Histogram(
+    "rotmaxxing_job_seconds",
+    "Duration of a job from start to finish.",
+    ["kind", "status"],
+    buckets=STAGE_BUCKETS,
+)
+jobs_waiting = Gauge(
+    "rotmaxxing_jobs_waiting",
+    "Jobs queued and not started yet.",
+    multiprocess_mode="livesum",
+)
+jobs_running = Gauge(
+    "rotmaxxing_jobs_running",
+    "Jobs running.",
+    multiprocess_mode="livesum",
+)
+ffmpeg_running = Gauge(
+    "rotmaxxing_ffmpeg_running",
+    "ffmpeg and ffprobe processes running.",
+    multiprocess_mode="livesum",
+)
+ffmpeg_waiting = Gauge(
+    "rotmaxxing_ffmpeg_waiting",
+    "ffmpeg and ffprobe runs waiting for the ffmpeg semaphore.",
+    multiprocess_mode="livesum",
+)
+whisper_running = Gauge(
+    "rotmaxxing_whisper_running",
+    "Whisper transcriptions running or queued on the transcription pool.",
+    multiprocess_mode="livesum",
+)
+cache_requests = Counter(
+    "rotmaxxing_cache_requests_total",
+    "Disk cache lookups, by cache and hit or miss.",
+    ["cache", "result"],
+)
+cache_bytes = Gauge(
+    "rotmaxxing_cache_bytes",
+    "Size of a disk cache.",
+    ["cache"],
+    multiprocess_mode="liveall",
+)
+
+
+@contextmanager
+def timed(stage: str):
+    """Records the time spent in the block in `rotmaxxing_stage_seconds`, also around awaits."""
+    with stage_seconds.labels(stage).time():
+        yield
+
+
+def render_metrics():
+    """
+    Renders the metrics in the Prometheus text format. With several uvicorn workers,
+    set PROMETHEUS_MULTIPROC_DIR so the metrics of all of them are collected.
+
+    :return: The body and its content type.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+async def require_metrics_token(request: Request):
+    """Lets a scrape through only with `Authorization: Bearer <METRICS_TOKEN>`."""
+    authorization = request.headers.get("Authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if not METRICS_TOKEN or scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Not authorized to read metrics")
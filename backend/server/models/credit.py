@@ -0,0 +1,20 @@
+from typing import Optional
+from beanie import Document
+from pydantic import BaseModel, Field
+from datetime import datetime, timezone
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+
+class CreditTransaction(Document, BaseModel):
+    """Append-only ledger entry, one per change of a user's credit."""
+
+    user_id: str
+    amount: int  # Negative for a charge, positive for a refund or a top-up
+    balance: int  # Credit of the user right after the change
+    reason: str  # e.g. "generate", "download", "refund"
+    reference: Optional[str] = None  # Job or folder the change is for
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    class Settings:
+        name = "credit_transactions"
+        indexes = [IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)])]
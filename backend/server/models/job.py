@@ -0,0 +1,73 @@
+from enum import Enum
+from typing import Any, Dict, Optional
+from beanie import Document
+from pydantic import BaseModel, Field
+from datetime import datetime, timezone
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+
+class JobBase(BaseModel):
+    user_id: str
+    kind: str  # Name of the pipeline handler, e.g. "generate" or "restyle"
+    folder_id: str
+    credits: int = 0  # Reserved when the job was submitted, refunded if it fails
+    refunded: bool = False
+    payload: Dict[str, Any] = Field(default_factory=dict)
+    status: JobStatus = JobStatus.queued
+    stage: Optional[str] = None
+    progress: float = 0.0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    owner: Optional[str] = None  # Process running the job, see JobQueue.owner
+    heartbeat_at: Optional[datetime] = None  # Refreshed by the owner while the job runs
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.completed, JobStatus.failed)
+
+
+class Job(Document, JobBase):
+    class Settings:
+        name = "jobs"
+
+
+class JobReturn(JobBase):
+    id: str = Field(..., alias="_id")  # Map `_id` to `id`
+
+    class Config:
+        from_attributes = True
+        populate_by_name = True  # Allow using `id` instead of `_id`
+
+    @classmethod
+    def from_document(cls, document: Job) -> "JobReturn":
+        return cls(id=str(document.id), **document.model_dump(exclude={"id", "revision_id"}))
+
+
+class JobPublic(BaseModel):
+    """What the API shows of a job, without the payload and the bookkeeping of `JobQueue`."""
+
+    id: str = Field(..., alias="_id")
+    kind: str
+    status: JobStatus
+    stage: Optional[str] = None
+    progress: float = 0.0
+    result: Optional[Dict[str, Any]] = None  # Holds the folder_id and the URL of the result ZIP
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+        populate_by_name = True
+
+    @classmethod
+    def from_job(cls, job: JobReturn) -> "JobPublic":
+        return cls.model_validate(job)
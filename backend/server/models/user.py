@@ -1,6 +1,7 @@
-from typing import Optional
-from beanie import Document
+from typing import Optional, Union
+from beanie import Document, PydanticObjectId
 from pydantic import BaseModel, Field
+from pymongo import IndexModel
 from datetime import datetime, timezone
 
 
@@ -14,11 +15,42 @@ class User(Document, BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     class Settings:
         collection = "users"
+        indexes = [
+            IndexModel("email", unique=True),
+            IndexModel("username", unique=True),
+            # Only Google accounts have a sub, the others store null
+            IndexModel("sub", unique=True, partialFilterExpression={"sub": {"$type": "string"}}),
+        ]
 
     class Config:
         from_attributes = True
 
 
+class UserFields(BaseModel):
+    """Projection of `User` to the fields of `UserReturn`, leaving `sub` and `created_at` in the database."""
+
+    id: PydanticObjectId = Field(..., alias="_id")
+    username: str
+    email: str
+    password: Optional[str] = None
+    credit: Optional[int] = 50
+    picture: Optional[str] = None
+
+
+class UserId(BaseModel):
+    """Projection of `User` to its id, for existence checks."""
+
+    id: PydanticObjectId = Field(..., alias="_id")
+
+
+class UserKeys(BaseModel):
+    """Projection of `User` to its id and the unique fields registration checks."""
+
+    id: PydanticObjectId = Field(..., alias="_id")
+    username: str
+    email: str
+
+
 class UserReturn(BaseModel):
     id: str = Field(..., alias="_id")  # Map `_id` to `id`
     username: str
@@ -32,7 +64,7 @@ class UserReturn(BaseModel):
         populate_by_name = True  # Allow using `id` instead of `_id`
 
     @classmethod
-    def from_document(cls, document: User) -> "UserReturn":
+    def from_document(cls, document: Union[User, UserFields]) -> "UserReturn":
         return cls(
             id=str(document.id), username=document.username, email=document.email, password=document.password, credit=document.credit, picture=document.picture
         )
@@ -1,136 +1,148 @@
-from tempfile import NamedTemporaryFile
 from fastapi import APIRouter, Depends, HTTPException
 from starlette.requests import Request
 from pathlib import Path
-from fastapi.responses import FileResponse
-import uuid, os
-import zipfile
-
-from server.auth.auth_bearer import JWTBearer
-from server.auth.auth_handler import decode_jwt
-from server.database import deduct_user_credit, get_user
-from server.utils.text_to_speech import text_to_speech
-from server.utils.generate_subtitles import generate_subtitles, update_subtitles_style
-from server.utils.video_proccessing import add_audio_to_video, process_video_output
-from server.schemas.upload import GenerateBrainrotSchema, GenerateDownloadSchema
+from fastapi.responses import Response, StreamingResponse
+import uuid, os, re
+
+from server.auth.auth_bearer import Principal, jwt_bearer
+from server.database import refund_credit, reserve_credit
+from server.utils.video_proccessing import load_render_source, process_video_output, render_cache, render_preview
+from server.utils.media import media_response
+from server.utils.zip_stream import zip_response
+from server.schemas.upload import GenerateBrainrotSchema, GenerateDownloadSchema, PreviewSchema
+from server.models.job import JobPublic, JobReturn, JobStatus
+from server.job_queue import job_queue
 from server.rate_limiter import limiter
-import asyncio
 
 upload_router = APIRouter()
 
-@upload_router.get("/static/{folder_id}/speech", include_in_schema=False, dependencies=[Depends(JWTBearer())])
-@limiter.limit("5/minute")
+GENERATE_COST = 5
+DOWNLOAD_COST = 5
+
+@upload_router.get("/static/{folder_id}/speech", include_in_schema=False, dependencies=[Depends(jwt_bearer)])
+@limiter.limit("120/minute")
 async def serve_speech(folder_id: str, request : Request):
     file_path = Path(os.getcwd() + f"/static/uploads/{folder_id}/speech.wav")
+    return media_response(request, file_path)
 
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-
-    return FileResponse(file_path)
 
-
-@upload_router.get("/static/{folder_id}/subtitles", include_in_schema=False, dependencies=[Depends(JWTBearer())])
-@limiter.limit("5/minute")
+@upload_router.get("/static/{folder_id}/subtitles", include_in_schema=False, dependencies=[Depends(jwt_bearer)])
+@limiter.limit("120/minute")
 async def serve_subtitles(folder_id: str, request : Request):
     file_path = Path(os.getcwd() + f"/static/uploads/{folder_id}/subtitles.srt")
+    return media_response(request, file_path)
 
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-
-    return FileResponse(file_path)
-
-@upload_router.post("/generateBrainrot", dependencies=[Depends(JWTBearer())])
+@upload_router.post("/generateBrainrot", status_code=202, response_model=JobPublic)
 @limiter.limit("33/minute")
-async def upload_file(upload: GenerateBrainrotSchema, request : Request, token: dict = Depends(JWTBearer())):
-    decoded_token = decode_jwt(token)
-    user = await get_user(decoded_token["user_id"])
-    user = dict(user)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    if user["credit"] < 5:
-        raise HTTPException(status_code=400, detail="Insufficient credits to process video")
-    await deduct_user_credit(user["id"], 5)
-    
+async def upload_file(upload: GenerateBrainrotSchema, request : Request, principal: Principal = Depends(jwt_bearer)):
+    kind, folder_id = "generate", str(uuid.uuid4())
     if upload.folder_id is not None:
-        print("ALREADY EXISTS VIDEO WITH AUDIO AND SUBTITLES")
+        # Video with audio and subtitles already exists, only the style changes
         folder_path = Path(os.getcwd() + f"/static/uploads/{upload.folder_id}")
-        video_path = folder_path / "temp_vid_with_audio.mp4"
-        subtitles_path = folder_path / "subtitles.ass"
-        if not folder_path.exists() or not video_path.exists() or not subtitles_path.exists():
+        if not folder_path.exists() or not (folder_path / "subtitles.ass").exists():
             raise HTTPException(status_code=400, detail="Folder not found")
-        
-        subtitles_path = await update_subtitles_style(
-            folder_id=upload.folder_id,
-            style=upload.subtitle_options,
-        )
-        
-        file_paths = [video_path, subtitles_path]
-        
-        with NamedTemporaryFile(delete=False, suffix=".zip") as tmp:
-            with zipfile.ZipFile(tmp.name, "w") as zipf:
-                for file_path in file_paths:
-                    file_name = Path(file_path).name
-                    zipf.write(file_path, arcname=file_name)
-
-            zip_file_path = tmp.name
-
-        return FileResponse(zip_file_path, media_type="application/zip", filename=f"{upload.folder_id}.zip")
-        
-    generated_id = uuid.uuid4()
-    background_videos_path = Path(os.getcwd() + "/static/background_videos")
-    random_background_video = background_videos_path / "mc_video.mp4"
-    folder_path = Path(os.getcwd() + f"/static/uploads/{generated_id}")
-    folder_path.mkdir(parents=True, exist_ok=True)
-    speech_path, duration = await text_to_speech(
-        text=upload.text, folder_id=generated_id, voice=upload.audio_options.voice
-    )
-    add_audio_task = asyncio.create_task(add_audio_to_video(
-        video_path=random_background_video,
-        audio_path=str(speech_path),
-        folder_id=generated_id,
-        video_duration=duration,
-    ))
-    generate_subtitles_task = asyncio.create_task(generate_subtitles(
-        folder_id=generated_id,
-        file_path=str(folder_path / "speech.wav"),
-        style=upload.subtitle_options,
-    ))
-
-    video_path = await add_audio_task
-    subtitles_path = await generate_subtitles_task
-    file_paths = [video_path, subtitles_path]
-    
-    with NamedTemporaryFile(delete=False, suffix=".zip") as tmp:
-        with zipfile.ZipFile(tmp.name, "w") as zipf:
-            for file_path in file_paths:
-                file_name = Path(file_path).name
-                zipf.write(file_path, arcname=file_name)
+        # render.json, or the muxed video of folders generated before it existed
+        try:
+            await load_render_source(upload.folder_id)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Folder not found")
+        kind, folder_id = "restyle", upload.folder_id
+
+    # The job refunds the credits if it fails
+    await reserve_credit(principal.user_id, GENERATE_COST, kind, folder_id)
+    try:
+        job = await job_queue.submit(principal.user_id, kind, folder_id, upload.model_dump(), credits=GENERATE_COST)
+    except Exception:
+        await refund_credit(principal.user_id, GENERATE_COST, folder_id)
+        raise
+    return JobPublic.from_job(job)
+
+
+async def get_user_job(job_id: str, principal: Principal) -> JobReturn:
+    job = await job_queue.get(job_id)
+    if not job or job.user_id != principal.user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@upload_router.get("/jobs/{job_id}", response_model=JobPublic)
+async def get_job(job_id: str, principal: Principal = Depends(jwt_bearer)):
+    return JobPublic.from_job(await get_user_job(job_id, principal))
+
 
-        zip_file_path = tmp.name
+@upload_router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, principal: Principal = Depends(jwt_bearer)):
+    await get_user_job(job_id, principal)
 
-    return FileResponse(zip_file_path, media_type="application/zip", filename=f"{str(generated_id)}.zip")
+    async def event_stream():
+        async for job in job_queue.subscribe(job_id):
+            yield f"event: {job.status.value}\ndata: {JobPublic.from_job(job).model_dump_json(by_alias=True)}\n\n"
 
-@upload_router.post("/generateDownload", dependencies=[Depends(JWTBearer())])
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@upload_router.get("/jobs/{job_id}/result")
+async def job_result(job_id: str, principal: Principal = Depends(jwt_bearer)):
+    job = await get_user_job(job_id, principal)
+    if job.status != JobStatus.completed:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status.value}")
+
+    folder_path = Path(os.getcwd() + f"/static/uploads/{job.folder_id}")
+    file_paths = [folder_path / file_name for file_name in job.result["files"]]
+
+    try:
+        return zip_response(file_paths, filename=f"{job.folder_id}.zip")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Job files not found")
+
+@upload_router.post("/preview", dependencies=[Depends(jwt_bearer)])
+@limiter.limit("60/minute")
+async def preview_subtitles(upload: PreviewSchema, request : Request):
+    folder_path = Path(os.getcwd() + f"/static/uploads/{upload.folder_id}")
+    if not (folder_path / "subtitles.ass").exists():
+        raise HTTPException(status_code=400, detail="Folder not found")
+
+    try:
+        preview = await render_preview(upload.folder_id, upload.subtitle_options, upload.seconds, upload.frames)
+    except Exception as e:
+        print(f"Error rendering preview: {e}")
+        raise HTTPException(status_code=500, detail="Error rendering preview")
+
+    return Response(preview, media_type="image/jpeg" if upload.frames else "video/mp4", headers={"Cache-Control": "no-store"})
+
+@upload_router.post("/generateDownload")
 @limiter.limit("10/minute")
-async def generate_download(upload: GenerateDownloadSchema, request : Request, token: dict = Depends(JWTBearer())):
-    decoded_token = decode_jwt(token)
-    user = await get_user(decoded_token["user_id"])
-    user = dict(user)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    if user["credit"] < 5:
-        raise HTTPException(status_code=400, detail="Insufficient credits to process video")
-    await deduct_user_credit(user["id"], 5)
-    
+async def generate_download(upload: GenerateDownloadSchema, request : Request, principal: Principal = Depends(jwt_bearer)):
     folder_path = Path(os.getcwd() + f"/static/uploads/{upload.folder_id}")
     if not folder_path.exists():
         raise HTTPException(status_code=400, detail="Folder not found")
+
+    await reserve_credit(principal.user_id, DOWNLOAD_COST, "download", upload.folder_id)
+    result = None
+    try:
+        result = await process_video_output(
+            video_path=str(folder_path / "temp_vid_with_audio.mp4"),
+            subtitles_path=str(folder_path / "subtitles.ass"),
+            folder_id=upload.folder_id,
+            video_options=upload.video_options,
+        )
+    finally:
+        if result is None:
+            await refund_credit(principal.user_id, DOWNLOAD_COST, upload.folder_id)
+    if result is None:
+        raise HTTPException(status_code=500, detail="Error processing video")
     
-    result = await process_video_output(
-        video_path=str(folder_path / "temp_vid_with_audio.mp4"),
-        subtitles_path=str(folder_path / "subtitles.ass"),
-        folder_id=upload.folder_id,
-        video_options=upload.video_options,
+    # Renders are content-addressed, players can seek and re-watch through the GET url
+    render_id = Path(result).stem
+    return media_response(
+        request, result, media_type="video/mp4", immutable=True,
+        headers={"Content-Location": f"/uploads/renders/{render_id}"},
     )
-    
-    return FileResponse(result, media_type="video/mp4")
+
+
+@upload_router.get("/renders/{render_id}", dependencies=[Depends(jwt_bearer)])
+@limiter.limit("120/minute")
+async def serve_render(render_id: str, request : Request):
+    if not re.fullmatch(r"[0-9a-f]{64}", render_id):
+        raise HTTPException(status_code=404, detail="File not found")
+    return media_response(request, render_cache.path(render_id), media_type="video/mp4", immutable=True)
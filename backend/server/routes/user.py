@@ -1,36 +1,46 @@
 # user_routes.py
-from fastapi import APIRouter, Depends, HTTPException, Request, Response
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from authlib.integrations.starlette_client import OAuthError
+from bson import ObjectId
+from datetime import datetime
+from typing import Optional
 
 import json, os
 
-from server.auth.auth_bearer import JWTBearer
+from server.auth.auth_bearer import Principal, get_current_user, jwt_bearer, require_admin
 from server.database import (
     create_user,
     create_user_google,
-    get_user,
     get_user_by_email,
     get_users,
+    iter_users,
     update_user,
+    upgrade_password_hash,
     delete_user,
 )
 from server.schemas.user import (
     UserGoogleRegisterSchema,
     UserRegisterSchema,
     UserLoginSchema,
+    UserPageSchema,
     UserResponseSchema,
     UserUpdateSchema,
 )
 from server.auth.auth_handler import decode_jwt, sign_jwt
+from server.models.user import UserReturn
 from server.auth.auth_bearer import oauth
-from server.utils.hashing import verify_password
+from server.utils.hashing import hash_password, password_hasher, verify_password
+from server.rate_limiter import limiter
 
 user_router = APIRouter()
 
+EXPORT_LINES_PER_CHUNK = 1000
+
 
 @user_router.post("/register", response_model=UserResponseSchema)
-async def register_user_endpoint(user_data: UserRegisterSchema):
+@limiter.limit("5/minute")
+async def register_user_endpoint(user_data: UserRegisterSchema, request: Request):
     if user_data.password != user_data.confirm_password:
         raise HTTPException(status_code=400, detail="Passwords do not match")
     
@@ -55,7 +65,8 @@ async def register_user_endpoint(user_data: UserRegisterSchema):
 
 
 @user_router.post("/login", response_model=UserResponseSchema)
-async def login_user_endpoint(user_data: UserLoginSchema):
+@limiter.limit("10/minute")
+async def login_user_endpoint(user_data: UserLoginSchema, request: Request):
     user = await get_user_by_email(user_data.email)
     if user is None:
         raise HTTPException(status_code=400, detail="User not found")
@@ -63,6 +74,13 @@ async def login_user_endpoint(user_data: UserLoginSchema):
     user_dict = dict(user)
     if not await verify_password(user_data.password, user_dict["password"]):
         raise HTTPException(status_code=400, detail="Invalid password")
+    if password_hasher.needs_rehash(user_dict["password"]):
+        # Legacy SHA-256 or an older cost, the plain password is only known at login.
+        # Best effort, the password was accepted and the next login tries again
+        try:
+            await upgrade_password_hash(user_dict["id"], user_dict["password"], await hash_password(user_data.password))
+        except Exception as e:
+            print(f"Error upgrading the password hash of user {user_dict['id']}: {e}")
     
     tokens = sign_jwt(user_dict["id"])
     response = JSONResponse(content=user_dict, status_code=201)
@@ -124,42 +142,63 @@ async def auth_google(request: Request):
     )
     return response 
 
-@user_router.post("/logout", dependencies=[Depends(JWTBearer())])
-async def logout(request: Request, response: Response, token: str = Depends(JWTBearer())):
+@user_router.post("/logout", dependencies=[Depends(jwt_bearer)])
+async def logout(request: Request, response: Response):
     response.delete_cookie("jwt")
     response.delete_cookie("refresh_token")
     return {"message": "Successfully logged out"}
 
 
-@user_router.get(
-    "/me", response_model=UserResponseSchema, dependencies=[Depends(JWTBearer())]
-)
-async def get_user_endpoint(token: str = Depends(JWTBearer())):
-    decoded_token = decode_jwt(token)
-    user = await get_user(decoded_token["user_id"])
-    if not user:
-        raise HTTPException(status_code=400, detail="User not found")
+@user_router.get("/me", response_model=UserResponseSchema)
+async def get_user_endpoint(user: UserReturn = Depends(get_current_user)):
     return user
 
 
-@user_router.patch(
-    "/me", response_model=UserResponseSchema, dependencies=[Depends(JWTBearer())]
-)
+@user_router.patch("/me", response_model=UserResponseSchema)
 async def update_user_endpoint(
-    user_data: UserUpdateSchema, token: str = Depends(JWTBearer())
+    user_data: UserUpdateSchema, principal: Principal = Depends(jwt_bearer)
 ):
-    decoded_token = decode_jwt(token)
-    user = await update_user(decoded_token["user_id"], user_data)
+    user = await update_user(principal.user_id, user_data)
     return user
 
 @user_router.get("/verify", response_model=UserResponseSchema)
-async def verify_user_endpoint(request: Request, token: str = Depends(JWTBearer())):
-    decoded_token = decode_jwt(token)
-    user = await get_user(decoded_token["user_id"])
-    if not user:
-        raise HTTPException(status_code=400, detail="User not found")
+async def verify_user_endpoint(request: Request, user: UserReturn = Depends(get_current_user)):
     return user
 
+@user_router.get("/", response_model=UserPageSchema, dependencies=[Depends(require_admin)])
+async def list_users_endpoint(limit: int = Query(100, ge=1, le=1000), after: Optional[str] = None):
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid page cursor")
+    users, next_after = await get_users(limit=limit, after=after)
+    return {"users": users, "next_after": next_after}
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+async def export_lines():
+    lines = []
+    async for document in iter_users(batch_size=EXPORT_LINES_PER_CHUNK):
+        document["id"] = str(document.pop("_id"))
+        lines.append(json.dumps(document, default=export_value) + "\n")
+        if len(lines) >= EXPORT_LINES_PER_CHUNK:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+@user_router.get("/export", dependencies=[Depends(require_admin)])
+async def export_users_endpoint():
+    """Every user as newline-delimited JSON, streamed from a database cursor."""
+    return StreamingResponse(
+        export_lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="users.ndjson"'},
+    )
+
+
 @user_router.post("/refresh")
 async def refresh_access_token(request: Request):
     refresh_token = request.cookies.get("refresh_token")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, model_validator
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Literal
 
 class SubtitleOptions(BaseModel):
     Name: str = Field(
@@ -112,6 +112,11 @@ class SubtitleOptions(BaseModel):
         description="The rotation angle of the text.",
         example=0,
     )
+    Karaoke: bool = Field(
+        False,
+        description="Highlight every word as it is spoken, from SecondaryColour to PrimaryColour.",
+        example=False,
+    )
 
 class VideoOptions(BaseModel):
     audio_fadein: int = Field(
@@ -139,6 +144,11 @@ class VideoOptions(BaseModel):
         description="The duration of the video.",
         example=20,
     )
+    profile: Literal["draft", "standard", "high"] = Field(
+        "standard",
+        description="Encoder profile, from fast and small (draft) to slow and sharp (high).",
+        example="standard",
+    )
     
 class AudioOptions(BaseModel):
     voice: str = Field(
@@ -146,6 +156,11 @@ class AudioOptions(BaseModel):
         description="The voice to be used for the audio.",
         example="alloy",
     )
+    split_sentences: bool = Field(
+        False,
+        description="Synthesize the text sentence by sentence in parallel, faster for long texts.",
+        example=False,
+    )
 
 class GenerateBrainrotSchema(BaseModel):
     folder_id: Optional[str] = Field(
@@ -159,6 +174,16 @@ class GenerateBrainrotSchema(BaseModel):
     )
     audio_options: AudioOptions
     subtitle_options: SubtitleOptions
+    preview: bool = Field(
+        True,
+        description="Also produce the video with audio (without subtitles) used to preview subtitle styles.",
+        example=True,
+    )
+    subtitle_mode: Literal["align", "transcribe"] = Field(
+        "align",
+        description="Align the known text to the speech (fast) or transcribe the speech with Whisper.",
+        example="align",
+    )
     
     
     class Config:
@@ -170,5 +195,28 @@ class GenerateDownloadSchema(BaseModel):
     )
     video_options: VideoOptions
     
+    class Config:
+        str_strip_whitespace = True
+
+class PreviewSchema(BaseModel):
+    folder_id: str = Field(
+        ..., description="The folder ID of the upload.", min_length=1, max_length=255
+    )
+    subtitle_options: SubtitleOptions
+    seconds: float = Field(
+        3,
+        description="How much of the start of the video to preview, in seconds.",
+        gt=0,
+        le=10,
+        example=3,
+    )
+    frames: int = Field(
+        4,
+        description="Number of still frames in the preview image, 0 for a short video clip instead.",
+        ge=0,
+        le=8,
+        example=4,
+    )
+    
     class Config:
         str_strip_whitespace = True
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, EmailStr, Field
 
 
@@ -31,3 +31,8 @@ class UserResponseSchema(BaseModel):
     class Config:
         from_attributes = True
         populate_by_name = True  # Allow using `id` instead of `_id`
+
+
+class UserPageSchema(BaseModel):
+    users: List[UserResponseSchema]
+    next_after: Optional[str] = None  # Pass as `after` for the next page, None on the last one
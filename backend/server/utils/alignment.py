@@ -0,0 +1,132 @@
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
+
+from server.utils.transcription import SAMPLE_RATE
+
+FRAME_S = 0.02
+
+
+@dataclass
+class AlignedWord:
+    start: float
+    end: float
+    word: str  # With a leading space, like faster-whisper words
+
+
+@dataclass
+class AlignedSegment:
+    start: float
+    end: float
+    text: str
+    words: List[AlignedWord] = field(default_factory=list)
+
+
+def align_text(audio, timings) -> List[AlignedSegment]:
+    """
+    Produces word timings for a script we already know, without running Whisper.
+
+    Every TTS segment's words are laid out over the voiced part of its time range:
+    frames whose energy is below the speech threshold are skipped, so pauses between
+    words and sentences are not covered by words, and each word gets voiced time in
+    proportion to its length.
+
+    :param audio: 16 kHz float32 samples of the speech.
+    :param timings: TTS segments, dicts with the segment `text`, `start` and `end` in seconds.
+    :return: One segment per sentence, with word timings.
+    """
+    words = []
+    for timing in timings:
+        tokens = timing["text"].split()
+        if not tokens:
+            continue
+        first_frame = int(timing["start"] / FRAME_S)
+        last_frame = max(first_frame + 1, int(timing["end"] / FRAME_S))
+        voiced = voiced_frames(audio[first_frame * int(FRAME_S * SAMPLE_RATE):last_frame * int(FRAME_S * SAMPLE_RATE)])
+        if not voiced.any():
+            voiced = np.ones(last_frame - first_frame, dtype=bool)
+
+        # Voiced time elapsed at every frame boundary of the segment
+        voiced_time = np.concatenate(([0.0], np.cumsum(voiced))) * FRAME_S
+        weights = np.array([len(token) + 1 for token in tokens], dtype=float)
+        bounds = np.concatenate(([0.0], np.cumsum(weights))) / weights.sum() * voiced_time[-1]
+
+        starts = voiced_to_time(voiced_time, bounds[:-1], side="right")
+        ends = voiced_to_time(voiced_time, bounds[1:], side="left")
+        snap_to_pauses(voiced, starts, ends)
+
+        offset = first_frame * FRAME_S
+        starts += offset
+        ends += offset
+        words.extend(AlignedWord(float(start), float(end), " " + token) for token, start, end in zip(tokens, starts, ends))
+
+    return group_sentences(words)
+
+
+def voiced_frames(audio) -> np.ndarray:
+    """Boolean mask of the FRAME_S frames that contain speech, by RMS energy."""
+    frame = int(FRAME_S * SAMPLE_RATE)
+    frame_count = max(1, len(audio) // frame)
+    samples = np.zeros(frame_count * frame, dtype=np.float32)
+    samples[:min(len(audio), len(samples))] = audio[:len(samples)]
+    energy = np.sqrt(np.mean(np.square(samples.reshape(frame_count, frame)), axis=1))
+    energy = np.convolve(energy, np.ones(3) / 3, mode="same")
+    return energy > max(0.1 * np.percentile(energy, 95), 1e-4)
+
+
+def voiced_to_time(voiced_time: np.ndarray, targets: np.ndarray, side: str) -> np.ndarray:
+    """
+    Maps amounts of voiced time to positions in the segment. Starts use side="right"
+    and ends side="left", so a target on the edge of a pause lands on the voiced side.
+    """
+    frames = np.clip(np.searchsorted(voiced_time, targets, side=side), 1, len(voiced_time) - 1) - 1
+    return frames * FRAME_S + np.clip(targets - voiced_time[frames], 0.0, FRAME_S)
+
+
+def snap_to_pauses(voiced: np.ndarray, starts: np.ndarray, ends: np.ndarray, tolerance: float = 0.3):
+    """
+    Moves word boundaries onto nearby pauses in place: the length-based estimate drifts
+    within a sentence, but real pauses between words are exact anchors. Boundaries and
+    pauses are both in time order, so they are matched in a single forward pass.
+    """
+    # Interior pauses as (first silent frame, first voiced frame after it)
+    edges = np.flatnonzero(np.diff(np.concatenate(([1], voiced.astype(np.int8), [1]))))
+    pauses = [(a * FRAME_S, b * FRAME_S) for a, b in zip(edges[::2], edges[1::2]) if a > 0 and b < len(voiced)]
+
+    next_pause = 0
+    for i in range(len(starts) - 1):
+        boundary = ends[i]
+        # Skip pauses that are too early for this boundary
+        while next_pause < len(pauses) and pauses[next_pause][1] < boundary - tolerance:
+            next_pause += 1
+        best = None
+        j = next_pause
+        while j < len(pauses) and pauses[j][0] <= boundary + tolerance:
+            if best is None or pause_distance(pauses[j], boundary) < pause_distance(pauses[best], boundary):
+                best = j
+            j += 1
+        if best is None or pauses[best][0] <= starts[i] or pauses[best][1] >= ends[i + 1]:
+            continue  # No pause nearby, or it would leave a word with no time
+        ends[i], starts[i + 1] = pauses[best]
+        next_pause = best + 1
+
+
+def pause_distance(pause, boundary: float) -> float:
+    return 0.0 if pause[0] <= boundary <= pause[1] else min(abs(boundary - pause[0]), abs(boundary - pause[1]))
+
+
+def group_sentences(words: List[AlignedWord]) -> List[AlignedSegment]:
+    segments, current = [], []
+    for i, word in enumerate(words):
+        current.append(word)
+        if re.search(r"[.!?…]$", word.word) or i == len(words) - 1:
+            segments.append(AlignedSegment(
+                start=current[0].start,
+                end=current[-1].end,
+                text="".join(w.word for w in current),
+                words=current,
+            ))
+            current = []
+    return segments
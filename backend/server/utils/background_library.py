@@ -0,0 +1,110 @@
+import json
+import random
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import List, Tuple
+
+from server.utils.ffmpeg_runner import probe
+
+background_videos_path = Path(__file__).resolve().parent.parent.parent / "static" / "background_videos"
+
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".mkv", ".webm"}
+
+
+@dataclass
+class BackgroundVideo:
+    name: str
+    size: int
+    mtime: float
+    duration: float
+    width: int
+    height: int
+    keyframes: List[float] = field(default_factory=list)  # Seconds from the start of the file
+
+
+class BackgroundLibrary:
+    """
+    Index of the background videos, built once at startup.
+
+    Every video's duration, resolution and keyframe timestamps are probed once and kept
+    in a manifest next to the videos, so picking a clip needs no probing and start
+    offsets can always land on a keyframe, making stream-copy cuts exact.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.manifest_path = self.root / ".manifest.json"
+        self.videos: List[BackgroundVideo] = []
+
+    async def load(self):
+        manifest = {}
+        if self.manifest_path.exists():
+            try:
+                manifest = {
+                    entry["name"]: BackgroundVideo(**entry)
+                    for entry in json.loads(self.manifest_path.read_text(encoding="utf-8"))
+                }
+            except (ValueError, TypeError, KeyError):
+                manifest = {}
+
+        videos, changed = [], False
+        for path in sorted(self.root.glob("*")) if self.root.exists() else []:
+            if path.suffix.lower() not in VIDEO_EXTENSIONS:
+                continue
+            stat = path.stat()
+            video = manifest.get(path.name)
+            if video is None or video.size != stat.st_size or video.mtime != stat.st_mtime:
+                try:
+                    video = await self.index_video(path)
+                except Exception as e:
+                    print(f"Skipping background video {path.name}: {e}")
+                    continue
+                changed = True
+            videos.append(video)
+
+        if changed or len(videos) != len(manifest):
+            self.manifest_path.write_text(json.dumps([asdict(video) for video in videos]), encoding="utf-8")
+        self.videos = videos
+
+    async def index_video(self, path: Path) -> BackgroundVideo:
+        # Packet flags tell keyframes apart without decoding a single frame
+        info = await probe(
+            path,
+            timeout=300,
+            v="error",
+            select_streams="v:0",
+            show_packets=None,
+            show_entries="packet=pts_time,flags:stream=width,height:format=duration,start_time",
+        )
+        start_time = float(info["format"].get("start_time", 0))
+        keyframes = sorted(
+            round(float(packet["pts_time"]) - start_time, 6)
+            for packet in info.get("packets", [])
+            if "K" in packet.get("flags", "") and packet.get("pts_time") not in (None, "N/A")
+        )
+        stat = path.stat()
+        return BackgroundVideo(
+            name=path.name,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            duration=float(info["format"]["duration"]),
+            width=int(info["streams"][0]["width"]),
+            height=int(info["streams"][0]["height"]),
+            keyframes=keyframes or [0.0],
+        )
+
+    def pick(self, duration: float) -> Tuple[Path, float]:
+        """
+        Picks a random video and a random keyframe-aligned start with `duration` seconds after it.
+
+        :return: Path of the video and the start offset in seconds.
+        """
+        if not self.videos:
+            raise RuntimeError(f"No background videos found in {self.root}")
+        long_enough = [video for video in self.videos if video.duration >= duration] or self.videos
+        video = random.choice(long_enough)
+        starts = [keyframe for keyframe in video.keyframes if keyframe <= video.duration - duration] or [0.0]
+        return self.root / video.name, random.choice(starts)
+
+
+background_library = BackgroundLibrary(background_videos_path)
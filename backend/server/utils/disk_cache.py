@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from server import metrics
+
+
+class DiskCache:
+    """
+    Content-addressed files on disk with a size budget and LRU eviction.
+
+    Every entry is `<key><suffix>` plus a `<key>.json` metadata sidecar. The index of
+    entries is kept in memory (rebuilt from the directory on first use) in least
+    recently used order, so lookups never touch the disk. Files are written to a
+    `temp_path` first; the ones left by a crash are deleted on first use once they are
+    `temp_max_age` seconds old, younger ones may be written by another process.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, suffix: str = "", temp_max_age: float = 3600):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.temp_max_age = temp_max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries: Optional[OrderedDict] = None  # key -> (size, metadata)
+        self._size = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha256("\0".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root / f"{key}{self.suffix}"
+
+    def metadata_path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def temp_path(self, key: str) -> Path:
+        """Unique file in the cache directory to write an entry to before `store(move=True)`."""
+        self._load()
+        # Unique, the same key can be written by two requests at once
+        return self.root / f"{key}.{uuid.uuid4().hex}.tmp{self.suffix}"
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """Returns the metadata of a cached entry and marks it as recently used, or None."""
+        entries = self._load()
+        if key in entries:
+            try:
+                # mtime records the last use, so the LRU order survives restarts
+                os.utime(self.path(key))
+            except FileNotFoundError:
+                self._size -= entries.pop(key)[0]
+        if key not in entries:
+            self.misses += 1
+            metrics.cache_requests.labels(self.root.name, "miss").inc()
+            return None
+        entries.move_to_end(key)
+        self.hits += 1
+        metrics.cache_requests.labels(self.root.name, "hit").inc()
+        return entries[key][1]
+
+    async def store(self, key: str, source: Path, metadata: dict, move: bool = False) -> Path:
+        """
+        Copies `source` into the cache under `key` and evicts entries over the budget.
+
+        :param move: Rename `source` into place instead of copying it, it has to be on the
+            same filesystem as the cache, e.g. a file written next to `path(key)`.
+        """
+        entries = self._load()
+        path = self.path(key)
+        await asyncio.to_thread(self._write, key, source, metadata, move)
+        if key in entries:
+            self._size -= entries.pop(key)[0]
+        size = path.stat().st_size
+        entries[key] = (size, metadata)
+        self._size += size
+        self._evict()
+        metrics.cache_bytes.labels(self.root.name).set(self._size)
+        return path
+
+    def stats(self) -> dict:
+        entries = self._load()
+        return {"hits": self.hits, "misses": self.misses, "entries": len(entries), "bytes": self._size}
+
+    def _write(self, key: str, source: Path, metadata: dict, move: bool):
+        # Write next to the final name and rename, so readers never see a partial file
+        path = self.path(key)
+        if not move:
+            tmp_path = self.temp_path(key)
+            shutil.copyfile(source, tmp_path)
+            source = tmp_path
+        os.replace(source, path)
+        self.metadata_path(key).write_text(json.dumps(metadata), encoding="utf-8")
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, (size, _) = self._entries.popitem(last=False)
+            self._size -= size
+            self.path(key).unlink(missing_ok=True)
+            self.metadata_path(key).unlink(missing_ok=True)
+
+    def _load(self) -> OrderedDict:
+        if self._entries is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._sweep()
+            found = []
+            for metadata_path in self.root.glob("*.json"):
+                key = metadata_path.stem
+                try:
+                    stat = self.path(key).stat()
+                    metadata = json.loads(metadata_path.read_text(encoding="utf-8"))
+                except (OSError, ValueError):
+                    continue
+                found.append((stat.st_mtime, key, stat.st_size, metadata))
+            self._entries = OrderedDict(
+                (key, (size, metadata)) for _, key, size, metadata in sorted(found, key=lambda entry: entry[0])
+            )
+            self._size = sum(size for size, _ in self._entries.values())
+            metrics.cache_bytes.labels(self.root.name).set(self._size)
+        return self._entries
+
+    def _sweep(self):
+        # Temp files of writes that never finished, e.g. a render killed with its process.
+        # Renders were written to `<key>.rendering.mp4` before `temp_path` existed.
+        cutoff = time.time() - self.temp_max_age
+        for path in [*self.root.glob("*.tmp*"), *self.root.glob("*.rendering.*")]:
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
@@ -0,0 +1,78 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from server.utils.ffmpeg_runner import FFMPEG_CONCURRENCY
+
+# Threads per encode, by default the cores are split between the encodes allowed to run at once
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", max(1, (os.cpu_count() or 2) // FFMPEG_CONCURRENCY)))
+
+
+@dataclass(frozen=True)
+class EncoderProfile:
+    preset: str  # x264 speed preset
+    crf: int  # Constant quality, lower is better and bigger
+    tune: Optional[str]
+    max_width: int  # Bounding box of the output for portrait video, swapped for landscape
+    max_height: int
+    max_fps: int
+    maxrate: str  # Bitrate cap, keeps uploads to short video platforms small
+    audio_bitrate: str
+
+    def scale_filter_args(self) -> dict:
+        """Arguments of a `scale` filter that fits the video in the profile's box, never upscaling."""
+        long_side, short_side = max(self.max_width, self.max_height), min(self.max_width, self.max_height)
+        return {
+            "w": f"if(gte(iw,ih),min(iw,{long_side}),min(iw,{short_side}))",
+            "h": f"if(gte(iw,ih),min(ih,{short_side}),min(ih,{long_side}))",
+            "force_original_aspect_ratio": "decrease",
+            "force_divisible_by": 2,
+        }
+
+    def output_args(self) -> dict:
+        """x264 and AAC output options of the profile for `ffmpeg.output`."""
+        args = {
+            "vcodec": "libx264",
+            "preset": self.preset,
+            "crf": self.crf,
+            "maxrate": self.maxrate,
+            "bufsize": self.maxrate,
+            "fpsmax": self.max_fps,
+            "threads": FFMPEG_THREADS,
+            "acodec": "aac",
+            "audio_bitrate": self.audio_bitrate,
+            "pix_fmt": "yuv420p",
+            "movflags": "+faststart",
+        }
+        if self.tune:
+            args["tune"] = self.tune
+        return args
+
+
+ENCODER_PROFILES = {
+    # Quick look at the result, fast to encode and to send
+    "draft": EncoderProfile(
+        preset="ultrafast", crf=30, tune="zerolatency", max_width=720, max_height=1280, max_fps=30,
+        maxrate="2M", audio_bitrate="96k",
+    ),
+    # What short video platforms re-encode to anyway
+    "standard": EncoderProfile(
+        preset="veryfast", crf=23, tune=None, max_width=1080, max_height=1920, max_fps=30,
+        maxrate="6M", audio_bitrate="128k",
+    ),
+    "high": EncoderProfile(
+        preset="slow", crf=19, tune="film", max_width=1080, max_height=1920, max_fps=60,
+        maxrate="12M", audio_bitrate="192k",
+    ),
+}
+DEFAULT_PROFILE = "standard"
+
+# Subtitle style previews, not offered for downloads
+PREVIEW_PROFILE = EncoderProfile(
+    preset="ultrafast", crf=32, tune="zerolatency", max_width=360, max_height=640, max_fps=12,
+    maxrate="1M", audio_bitrate="64k",
+)
+
+
+def get_encoder_profile(name: Optional[str]) -> EncoderProfile:
+    return ENCODER_PROFILES.get(name or DEFAULT_PROFILE, ENCODER_PROFILES[DEFAULT_PROFILE])
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+import ffmpeg
+
+from server import metrics
+
+FFMPEG_CONCURRENCY = int(os.getenv("FFMPEG_CONCURRENCY", os.cpu_count() or 2))
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", 600))
+
+# Bounds how many ffmpeg/ffprobe processes this worker runs at once
+ffmpeg_semaphore = asyncio.Semaphore(FFMPEG_CONCURRENCY)
+
+ProgressCallback = Callable[[float], Awaitable[None]]
+
+
+class FFmpegError(Exception):
+    def __init__(self, message: str, stderr: str = ""):
+        super().__init__(message)
+        self.stderr = stderr
+
+    def __str__(self):
+        return f"{self.args[0]}\n{self.stderr}" if self.stderr else self.args[0]
+
+
+async def run_ffmpeg(stream, duration: Optional[float] = None, on_progress: Optional[ProgressCallback] = None, timeout: Optional[float] = FFMPEG_TIMEOUT):
+    """
+    Runs an ffmpeg-python output stream as an asyncio subprocess.
+
+    :param stream: ffmpeg-python output stream, as passed to `ffmpeg.run`.
+    :param duration: Expected output duration in seconds, used to turn progress into a fraction.
+    :param on_progress: Coroutine called with the completed fraction (0.0 - 1.0) as encoding advances.
+    :param timeout: Seconds after which ffmpeg is killed and `FFmpegError` raised.
+    """
+    args = ffmpeg.compile(stream, overwrite_output=True)
+    args = [args[0], "-nostats", "-progress", "pipe:1", *args[1:]]
+
+    async def report_progress(stdout):
+        # -progress writes blocks of key=value lines, each terminated by a `progress=` line
+        out_time = 0.0
+        async for line in stdout:
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            if key in ("out_time_us", "out_time_ms") and value.isdigit():  # both are microseconds
+                out_time = int(value) / 1_000_000
+            elif key == "progress" and on_progress and duration:
+                await on_progress(1.0 if value == "end" else min(out_time / duration, 1.0))
+
+    await run_process(args, timeout, report_progress)
+
+
+async def probe(path, timeout: Optional[float] = 30, **kwargs) -> dict:
+    """Async equivalent of `ffmpeg.probe`."""
+    args = ["ffprobe", "-show_format", "-show_streams", "-of", "json"]
+    for key, value in kwargs.items():
+        # None marks a flag without a value, e.g. show_packets=None
+        args += [f"-{key}"] if value is None else [f"-{key}", str(value)]
+    args.append(str(path))
+
+    output = bytearray()
+
+    async def collect(stdout):
+        output.extend(await stdout.read())
+
+    with metrics.timed("probe"):
+        await run_process(args, timeout, collect)
+    return json.loads(output.decode("utf-8"))
+
+
+@asynccontextmanager
+async def ffmpeg_slot():
+    """Holds one of the FFMPEG_CONCURRENCY slots, counted in the ffmpeg gauges."""
+    with metrics.ffmpeg_waiting.track_inprogress():
+        await ffmpeg_semaphore.acquire()
+    try:
+        with metrics.ffmpeg_running.track_inprogress():
+            yield
+    finally:
+        ffmpeg_semaphore.release()
+
+
+async def run_process(args, timeout, read_stdout):
+    """Runs `args` under the ffmpeg semaphore, killing the process on timeout or cancellation."""
+    async with ffmpeg_slot():
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stderr_tail = deque(maxlen=40)
+
+        async def read_stderr():
+            async for line in process.stderr:
+                stderr_tail.append(line.decode(errors="replace").rstrip())
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(read_stdout(process.stdout), read_stderr(), process.wait()),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            raise FFmpegError(f"{args[0]} timed out after {timeout}s", "\n".join(stderr_tail))
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        if process.returncode != 0:
+            raise FFmpegError(f"{args[0]} exited with code {process.returncode}", "\n".join(stderr_tail))
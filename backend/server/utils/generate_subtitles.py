@@ -1,199 +1,176 @@
 import asyncio
+import json
+import os
 from pathlib import Path
-from faster_whisper import WhisperModel
-from pydub import AudioSegment
+from typing import NamedTuple
 
-output_dest = Path(__file__).resolve().parent.parent.parent / "static" / "uploads"
-num_workers=4
-model = WhisperModel('tiny', device="cpu", cpu_threads=2, compute_type="float32", num_workers=num_workers)
-
-SUBTITLE_POSITIONS = {
-    "bottom-left": 1,
-    "bottom-center": 2,
-    "bottom-right": 3,
-    "middle-left": 4,
-    "center": 5,
-    "middle-right": 6,
-    "top-left": 9,
-    "top-center": 8,
-    "top-left": 7,
-}
-
-async def generate_subtitles(folder_id: str, file_path: str, style: dict):
-    chunks = await split_audio(file_path, chunk_length_ms=30000)
-    
-    output_dir_chunks = Path(output_dest) / str(folder_id) / "chunks"
-    output_dir_chunks.mkdir(parents=True, exist_ok=True)
-    
-    # Save the chunks to files
-    chunk_files = []
-    for i, chunk in enumerate(chunks):
-        chunk_path = output_dir_chunks / f"chunk_{i * 30}.wav"
-        chunk.export(chunk_path, format="wav")
-        chunk_files.append(chunk_path)
-        
-    segments = await process_chunks_with_executor(chunk_files)
-
-    await save_as_ass(segments, output_dest / str(folder_id) / "subtitles.ass", style)
-    for chunk_file in output_dir_chunks.iterdir():
-        chunk_file.unlink()
-    output_dir_chunks.rmdir()
-    return output_dest / str(folder_id) / "subtitles.ass"
-
-async def update_subtitles_style(folder_id: str, style : dict):
-    ass_file_path = output_dest / str(folder_id) / "subtitles.ass"
-    if not ass_file_path.exists():
-        raise FileNotFoundError(f"Subtitle file not found at {ass_file_path}")
+import numpy as np
 
-    with open(ass_file_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-        
-    style = dict(style)
-    style["Alignment"] = SUBTITLE_POSITIONS[style["Alignment"]]
-    style["PrimaryColour"] = await convert_subtitle_color(style['PrimaryColour'])
-    style["SecondaryColour"] = await convert_subtitle_color(style['SecondaryColour'])
-    style["BackColour"] = await convert_subtitle_color(style['BackColour'])
-    style_string = f"Style: {style['Name']},{style['Fontname']},{style['Fontsize']},{style['PrimaryColour']},{style['SecondaryColour']},{style['OutlineColour']},{style['BackColour']},{style['Bold']},{style['Italic']},{style['Underline']},{style['StrikeOut']},{style['ScaleX']},{style['ScaleY']},{style['Spacing']},{style['Angle']},{style['BorderStyle']},{style['Outline']},{style['Shadow']},{style['Alignment']},{style['MarginL']},{style['MarginR']},{style['MarginV']},1"
-    
-    for i, line in enumerate(lines):
-        if line.startswith("Style:"):
-            lines[i] = style_string + "\n"
-            break
+from server import metrics
+from server.utils.transcription import transcription_service, SAMPLE_RATE
+from server.utils.alignment import align_text
+from server.utils.subtitle_document import SubtitleDocument, SubtitleStyle
 
-    with open(ass_file_path, "w", encoding="utf-8") as f:
-        f.writelines(lines)
-    return output_dest / str(folder_id) / "subtitles.ass"
+output_dest = Path(__file__).resolve().parent.parent.parent / "static" / "uploads"
+# Shorter chunks transcribe in parallel on more threads
+chunk_length_s = float(os.getenv("SUBTITLE_CHUNK_SECONDS", 30))
 
-async def save_as_ass(segments, output_dest, style, max_chars_per_line=25):
+async def generate_subtitles(folder_id: str, file_path: str, style: dict, mode: str = "transcribe"):
     """
-    Saves all transcription segments as a single ASS subtitle file, splitting up segments into smaller chunks.
+    Generates subtitles.ass for the speech at `file_path`.
 
-    :param segments: All transcription segments from all chunks.
-    :param output_dest: Path to save the subtitle file.
-    :param style: Dictionary containing subtitle styling options.
-    :param max_chars_per_line: Maximum number of characters per subtitle line.
-    :return: None
+    :param mode: "align" lays the known script (speech.json written by text_to_speech) over
+        the audio, "transcribe" runs Whisper. Aligning falls back to Whisper when there is no script.
     """
-    # Style setup
-    style = dict(style)
-    style["Alignment"] = SUBTITLE_POSITIONS[style["Alignment"]]
-    style["PrimaryColour"] = await convert_subtitle_color(style['PrimaryColour'])
-    style["SecondaryColour"] = await convert_subtitle_color(style['SecondaryColour'])
-    style["BackColour"] = await convert_subtitle_color(style['BackColour'])
-    style_string = f"Style: {style['Name']},{style['Fontname']},{style['Fontsize']},{style['PrimaryColour']},{style['SecondaryColour']},{style['OutlineColour']},{style['BackColour']},{style['Bold']},{style['Italic']},{style['Underline']},{style['StrikeOut']},{style['ScaleX']},{style['ScaleY']},{style['Spacing']},{style['Angle']},{style['BorderStyle']},{style['Outline']},{style['Shadow']},{style['Alignment']},{style['MarginL']},{style['MarginR']},{style['MarginV']},1"
-
-    # ASS subtitle file content
-    ass_content = f"""
-[Script Info]
-Title: Example Transcription
-Original Script: OpenAI Whisper
-ScriptType: v4.00+
-Collisions: Normal
-PlayDepth: 0
-
-[V4+ Styles]
-Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
-{style_string}
-
-[Events]
-Format: Marked, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
-"""
-
-    for segment in segments:
-        start_time = segment.start
-        end_time = segment.end
-        text = segment.text.strip()
-
-        # Split text into smaller chunks
-        text_chunks = []
-        current_chunk = ""
-        for word in text.split():
-            if len(current_chunk) + len(word) + 1 > max_chars_per_line:
-                text_chunks.append(current_chunk.strip())
-                current_chunk = ""
-            current_chunk += word + " "
-        if current_chunk:
-            text_chunks.append(current_chunk.strip())
+    audio = await transcription_service.decode_audio(file_path)
+    timings_path = Path(file_path).with_suffix(".json")
+
+    if mode == "align" and timings_path.exists():
+        timings = json.loads(timings_path.read_text(encoding="utf-8"))["segments"]
+        with metrics.timed("align"):
+            segments = align_text(audio, timings)
+    else:
+        with metrics.timed("chunking"):
+            chunks = split_audio(audio, chunk_length_s=chunk_length_s)
+        segments = await process_chunks_with_executor(chunks)
+
+    with metrics.timed("subtitles_write"):
+        document = SubtitleDocument.from_segments(segments, style)
+        return await asyncio.to_thread(document.save, output_dest / str(folder_id))
+
+async def update_subtitles_style(folder_id: str, style : dict, output_path=None):
+    """
+    Replaces the style of the folder's subtitles, re-serializing them from subtitles.json.
 
-        # Calculate duration per chunk
-        total_duration = end_time - start_time
-        chunk_duration = total_duration / len(text_chunks)
+    :param output_path: Write the restyled ASS here instead of over the folder's
+        subtitles, e.g. for a preview.
+    :return: Path of the restyled ASS file.
+    """
+    folder_path = output_dest / str(folder_id)
+    document = await asyncio.to_thread(SubtitleDocument.load, folder_path)
+    if document is None:
+        return await update_legacy_subtitles_style(folder_path / "subtitles.ass", style, output_path)
 
-        # Add each chunk as a separate subtitle line
-        for i, chunk in enumerate(text_chunks):
-            chunk_start_time = start_time + (i * chunk_duration)
-            chunk_end_time = start_time + ((i + 1) * chunk_duration)
+    with metrics.timed("subtitles_write"):
+        document.restyle(style)
+        return await asyncio.to_thread(document.save, folder_path, output_path)
 
-            start_time_str = f"{int(chunk_start_time // 3600):01}:{int((chunk_start_time % 3600) // 60):02}:{int(chunk_start_time % 60):02}.{int((chunk_start_time * 1000) % 1000):03}"
-            end_time_str = f"{int(chunk_end_time // 3600):01}:{int((chunk_end_time % 3600) // 60):02}:{int(chunk_end_time % 60):02}.{int((chunk_end_time * 1000) % 1000):03}"
+async def update_legacy_subtitles_style(ass_file_path: Path, style: dict, output_path=None):
+    # Uploads from before subtitles.json only have the ASS file, swap its style line
+    if not ass_file_path.exists():
+        raise FileNotFoundError(f"Subtitle file not found at {ass_file_path}")
 
-            ass_content += f"Dialogue: 0,{start_time_str},{end_time_str},Default,,0,0,0,,{chunk}\n"
+    with open(ass_file_path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
 
-    # Save final ASS file
-    with open(output_dest, "w", encoding="utf-8") as f:
-        f.write(ass_content)
+    for i, line in enumerate(lines):
+        if line.startswith("Style:"):
+            lines[i] = SubtitleStyle.from_options(style).to_ass() + "\n"
+            break
 
+    output_path = ass_file_path if output_path is None else output_path
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    return output_path
 
-async def convert_subtitle_color(hex_color):
+async def transcribe_chunk(audio, offset: float):
     """
-    Converts a hex color (#RRGGBB or #AARRGGBB) to the .ass subtitle format (&HAABBGGRR).
-    
-    :param hex_color: Hex color as a string (e.g., "#RRGGBB" or "#AARRGGBB").
-    :return: Color in .ass subtitle format (&HAABBGGRR).
-    """
-    # Remove leading '#' if present
-    hex_color = hex_color.lstrip('#')
-    
-    # If only RGB is provided, add default alpha (00 for fully opaque)
-    if len(hex_color) == 6:
-        hex_color = '00' + hex_color
-    
-    # Parse alpha, red, green, blue
-    alpha = hex_color[:2]
-    red = hex_color[2:4]
-    green = hex_color[4:6]
-    blue = hex_color[6:8]
-    
-    # Reorder to &HAABBGGRR
-    ass_color = f"&H{alpha}{blue}{green}{red}"
-    
-    return ass_color
+    Transcribes a slice of the decoded audio.
 
-def transcribe_chunk(chunk_file: str):
-    segments, info = model.transcribe(chunk_file, beam_size=8,word_timestamps=True)
-    start_time = str(chunk_file).split('_')[1].split('.')[0]
-    segments = list(segments)
+    :param audio: float32 samples of the chunk, a view into the full recording.
+    :param offset: Start of the chunk in the full recording, in seconds.
+    """
+    with metrics.timed("transcribe_chunk"):
+        segments = await transcription_service.transcribe(audio, beam_size=8, word_timestamps=True)
     for segment in segments:
-        segment.start += int(start_time)
-        segment.end += int(start_time)
+        segment.start += offset
+        segment.end += offset
+        for word in segment.words or []:
+            word.start += offset
+            word.end += offset
     return segments
 
-async def process_chunks_with_executor(chunk_files):
-    tasks = [asyncio.to_thread(transcribe_chunk, chunk_file) for chunk_file in chunk_files]
+async def process_chunks_with_executor(chunks):
+    tasks = [transcribe_chunk(chunk.audio, chunk.offset) for chunk in chunks]
     results = await asyncio.gather(*tasks)
     
     all_segments = []
-    for path, segments in zip(chunk_files, results):
-        print(
-            "Transcription for %s:%s"
-            % (path, "".join(segment.text for segment in segments))
-        )
-        all_segments.extend(segments)
+    for chunk, segments in zip(chunks, results):
+        all_segments.extend(trim_segments(segments, chunk.start, chunk.end))
     return all_segments
 
-async def split_audio(file_path: str, chunk_length_ms: int = 30000):
-    # Load the audio file
-    audio = AudioSegment.from_file(file_path)
-    
-    # Determine the total length of the audio in milliseconds
-    audio_length_ms = len(audio)
-    
-    # Split the audio into fixed-size chunks
-    chunks = [
-        audio[i:i+chunk_length_ms]
-        for i in range(0, audio_length_ms, chunk_length_ms)
-    ]
-    
+def trim_segments(segments, start: float, end: float):
+    """
+    Keeps only the words a chunk owns, dropping the ones that were transcribed from
+    the overlap with its neighbours. A word belongs to the chunk its midpoint falls in.
+    """
+    kept = []
+    for segment in segments:
+        if not segment.words:
+            if start <= (segment.start + segment.end) / 2 < end:
+                kept.append(segment)
+            continue
+
+        words = [word for word in segment.words if start <= (word.start + word.end) / 2 < end]
+        if not words:
+            continue
+        if len(words) != len(segment.words):
+            segment.words = words
+            segment.start = words[0].start
+            segment.end = words[-1].end
+            segment.text = "".join(word.word for word in words)
+        kept.append(segment)
+    return kept
+
+class AudioChunk(NamedTuple):
+    offset: float  # Start of `audio` in the recording, in seconds
+    audio: np.ndarray  # View into the decoded recording, including the overlap
+    start: float  # Range of the recording this chunk owns when merging, in seconds
+    end: float
+
+def split_audio(audio, chunk_length_s: float = 30, overlap_s: float = 0.5, search_s: float = 5, frame_s: float = 0.02):
+    """
+    Splits decoded audio into chunks of at most `chunk_length_s`, cutting at the quietest
+    point of the last `search_s` seconds of every chunk so words are not split in half.
+
+    :param audio: 16 kHz float32 samples of the whole recording.
+    :param overlap_s: Extra audio given to each side of a cut, de-duplicated in `trim_segments`.
+    :return: List of `AudioChunk`, their samples are views into `audio`.
+    """
+    # Shorter chunks would leave no room to search for a cut between the overlaps
+    chunk_length_s = max(chunk_length_s, 2 * overlap_s + search_s)
+    frame = int(frame_s * SAMPLE_RATE)
+    overlap = int(overlap_s * SAMPLE_RATE)
+    # Both overlaps have to fit in Whisper's 30 s window
+    max_length = int(chunk_length_s * SAMPLE_RATE) - 2 * overlap
+    search = min(int(search_s * SAMPLE_RATE), max_length // 2)
+
+    if len(audio) <= max_length:
+        # Nothing to cut, and too short audio has no frames to measure
+        return [AudioChunk(offset=0.0, audio=audio, start=float("-inf"), end=float("inf"))]
+
+    # RMS energy per frame, smoothed over ~100 ms so a quiet frame inside a word doesn't count as silence
+    frame_count = len(audio) // frame
+    energy = np.sqrt(np.mean(np.square(audio[:frame_count * frame].reshape(frame_count, frame)), axis=1))
+    energy = np.convolve(energy, np.ones(5) / 5, mode="same")
+
+    cuts = [0]
+    while len(audio) - cuts[-1] > max_length:
+        first_frame = (cuts[-1] + max_length - search) // frame
+        last_frame = (cuts[-1] + max_length) // frame
+        quietest = first_frame + int(np.argmin(energy[first_frame:last_frame]))
+        cuts.append(quietest * frame)
+    cuts.append(len(audio))
+
+    chunks = []
+    for i, (start, end) in enumerate(zip(cuts, cuts[1:])):
+        chunk_start = max(0, start - overlap)
+        chunks.append(AudioChunk(
+            offset=chunk_start / SAMPLE_RATE,
+            audio=audio[chunk_start:end + overlap],
+            start=start / SAMPLE_RATE if i > 0 else float("-inf"),
+            end=end / SAMPLE_RATE if end < len(audio) else float("inf"),
+        ))
     return chunks
 
 if __name__ == "__main__":
@@ -1,9 +1,134 @@
+import asyncio
+import base64
 import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Optional
+
+from server import metrics
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+@dataclass(frozen=True)
+class ScryptCost:
+    log_n: int  # CPU and memory cost, N = 2 ** log_n
+    r: int  # Block size, memory is about 128 * r * N bytes
+    p: int  # Parallelism, multiplies the CPU cost but not the memory
+
+    @property
+    def n(self) -> int:
+        return 2 ** self.log_n
+
+    @property
+    def maxmem(self) -> int:
+        # OpenSSL refuses to go over maxmem, leave room above 128 * r * N
+        return 2 * 128 * self.r * self.n + 1024 * 1024
+
+
+def encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+class PasswordHasher:
+    """
+    Salted scrypt password hashes, computed on a bounded pool of threads.
+
+    A hash costs tens of milliseconds of CPU by design, so it never runs on the event
+    loop: concurrent logins queue for one of `max_workers` threads (hashlib releases
+    the GIL during scrypt). Hashes are stored as `scrypt$log_n$r$p$salt$key`, so the
+    cost can be raised later and old hashes still verify. Unsalted SHA-256 hex digests
+    from before are accepted too, see `needs_rehash`.
+    """
+
+    def __init__(self, cost: ScryptCost, max_workers: Optional[int] = None):
+        self.cost = cost
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password")
+        return self._executor
+
+    async def hash(self, password: str) -> str:
+        loop = asyncio.get_running_loop()
+        with metrics.timed("password_hash"):
+            return await loop.run_in_executor(self.executor, partial(self.hash_sync, password))
+
+    async def verify(self, password: str, hashed_password: Optional[str]) -> bool:
+        if not hashed_password:
+            return False  # Google accounts have no password
+        loop = asyncio.get_running_loop()
+        with metrics.timed("password_verify"):
+            return await loop.run_in_executor(self.executor, partial(self.verify_sync, password, hashed_password))
+
+    def needs_rehash(self, hashed_password: Optional[str]) -> bool:
+        """True for legacy SHA-256 hashes and scrypt hashes made with another cost."""
+        if not hashed_password:
+            return False
+        parts = hashed_password.split("$")
+        if len(parts) != 6 or parts[0] != SCHEME or not all(part.isdigit() for part in parts[1:4]):
+            return True
+        return ScryptCost(int(parts[1]), int(parts[2]), int(parts[3])) != self.cost
+
+    def hash_sync(self, password: str, cost: Optional[ScryptCost] = None) -> str:
+        cost = cost or self.cost
+        salt = os.urandom(SALT_BYTES)
+        key = self.derive(password, salt, cost, KEY_BYTES)
+        return f"{SCHEME}${cost.log_n}${cost.r}${cost.p}${encode(salt)}${encode(key)}"
+
+    def verify_sync(self, password: str, hashed_password: str) -> bool:
+        parts = hashed_password.split("$")
+        if len(parts) == 6 and parts[0] == SCHEME:
+            # A malformed hash or cost fails to verify instead of failing the login
+            try:
+                cost = ScryptCost(int(parts[1]), int(parts[2]), int(parts[3]))
+                salt, expected = decode(parts[4]), decode(parts[5])
+                if not expected:
+                    return False
+                return hmac.compare_digest(self.derive(password, salt, cost, len(expected)), expected)
+            except (ValueError, TypeError, OverflowError, MemoryError):
+                return False
+        # Legacy, unsalted SHA-256 hex digest
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed_password)
+
+    @staticmethod
+    def derive(password: str, salt: bytes, cost: ScryptCost, length: int) -> bytes:
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=cost.n, r=cost.r, p=cost.p, maxmem=cost.maxmem, dklen=length,
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Defaults follow the OWASP minimum for scrypt (N=2^14, r=8, p=5), about 16 MiB per hash
+password_hasher = PasswordHasher(
+    cost=ScryptCost(
+        log_n=int(os.getenv("PASSWORD_SCRYPT_LOG_N", 14)),
+        r=int(os.getenv("PASSWORD_SCRYPT_R", 8)),
+        p=int(os.getenv("PASSWORD_SCRYPT_P", 5)),
+    ),
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", 0)) or None,
+)
 
 
 async def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    return await password_hasher.hash(password)
 
 
 async def verify_password(password: str, hashed_password: str) -> bool:
-    return await hash_password(password) == hashed_password
+    return await password_hasher.verify(password, hashed_password)
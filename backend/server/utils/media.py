@@ -0,0 +1,67 @@
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response
+from starlette.requests import Request
+
+# Upload folders can be restyled in place, so clients revalidate, which usually costs a 304
+REVALIDATE = "private, no-cache"
+# Content-addressed outputs never change under the same URL
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+
+def file_etag(stat: os.stat_result) -> str:
+    # Same as Starlette's FileResponse, so If-Range requests keep matching
+    return '"' + hashlib.md5(f"{stat.st_mtime}-{stat.st_size}".encode(), usedforsecurity=False).hexdigest() + '"'
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def media_response(
+    request: Request,
+    path: Path,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    immutable: bool = False,
+    headers: Optional[dict] = None,
+) -> Response:
+    """
+    Serves a file for media players: byte ranges (206/416) so seeking reads only what
+    is played, ETag and Last-Modified validators answered with 304 on repeat views,
+    and Cache-Control so browsers keep what they already downloaded.
+
+    :param immutable: The file is content-addressed, cache it without revalidating.
+    """
+    try:
+        stat = Path(path).stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    etag = file_etag(stat)
+    headers = {
+        **(headers or {}),
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE if immutable else REVALIDATE,
+    }
+    if request.method in ("GET", "HEAD") and is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    # Range and If-Range are handled by FileResponse itself
+    return FileResponse(path, media_type=media_type, filename=filename, stat_result=stat, headers=headers)
@@ -0,0 +1,95 @@
+import asyncio
+from pathlib import Path
+
+from server.schemas.upload import GenerateBrainrotSchema
+from server.utils.text_to_speech import text_to_speech
+from server.utils.generate_subtitles import generate_subtitles, update_subtitles_style
+from server.utils.video_proccessing import add_audio_to_video
+from server.utils.background_library import background_library
+from server.utils.render_planner import RenderSource
+
+output_dest = Path(__file__).resolve().parent.parent.parent / "static" / "uploads"
+
+
+async def generate_brainrot(job, report) -> dict:
+    """
+    Job handler for a new generation: speech, background video with audio and subtitles.
+
+    :param job: The queued job, its payload is a `GenerateBrainrotSchema`.
+    :param report: Coroutine called with (stage, progress) as the pipeline advances.
+    :return: The job result with the folder and the generated file names.
+    """
+    upload = GenerateBrainrotSchema(**job.payload)
+    folder_path = output_dest / job.folder_id
+    folder_path.mkdir(parents=True, exist_ok=True)
+
+    await report("text_to_speech", 0.1)
+    speech_path, duration = await text_to_speech(
+        text=upload.text,
+        folder_id=job.folder_id,
+        voice=upload.audio_options.voice,
+        split_sentences=upload.audio_options.split_sentences,
+    )
+
+    await report("video_and_subtitles", 0.4)
+    background_path, background_start = background_library.pick(duration)
+    # The final render reads the original inputs directly, see plan_render
+    RenderSource(
+        background=str(background_path),
+        start=background_start,
+        duration=duration,
+        speech=str(speech_path),
+    ).save(folder_path)
+
+    subtitles_task = generate_subtitles(
+        folder_id=job.folder_id,
+        file_path=str(speech_path),
+        style=upload.subtitle_options,
+        mode=upload.subtitle_mode,
+    )
+    if not upload.preview:
+        subtitles_path = await subtitles_task
+        return job_result(job, [subtitles_path])
+
+    async def mux_progress(fraction):
+        await report("video_and_subtitles", 0.4 + 0.5 * fraction)
+
+    # The muxed video is only needed to preview the subtitles in the browser
+    video_path, subtitles_path = await asyncio.gather(
+        add_audio_to_video(
+            video_path=background_path,
+            audio_path=str(speech_path),
+            folder_id=job.folder_id,
+            video_duration=duration,
+            start=background_start,
+            on_progress=mux_progress,
+        ),
+        subtitles_task,
+    )
+    if video_path is None:
+        raise RuntimeError("Failed to add audio to the background video")
+
+    return job_result(job, [video_path, subtitles_path])
+
+
+async def restyle_brainrot(job, report) -> dict:
+    """Job handler that only rewrites the subtitle style of an existing generation."""
+    upload = GenerateBrainrotSchema(**job.payload)
+    folder_path = output_dest / job.folder_id
+
+    await report("subtitles", 0.5)
+    subtitles_path = await update_subtitles_style(
+        folder_id=job.folder_id,
+        style=upload.subtitle_options,
+    )
+    # The muxed video only exists if the generation was made with a preview
+    return job_result(job, [folder_path / "temp_vid_with_audio.mp4", subtitles_path])
+
+
+def job_result(job, file_paths) -> dict:
+    """:param file_paths: Files of the result, those that don't exist are left out."""
+    return {
+        "folder_id": job.folder_id,
+        "files": [Path(file_path).name for file_path in file_paths if Path(file_path).exists()],
+        "url": f"/uploads/jobs/{job.id}/result",
+    }
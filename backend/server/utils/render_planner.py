@@ -0,0 +1,109 @@
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+import ffmpeg
+
+from server.utils.encoder_profiles import PREVIEW_PROFILE, get_encoder_profile
+
+fonts_dir = Path(__file__).resolve().parent.parent.parent / "static" / "fonts"
+
+
+@dataclass
+class RenderSource:
+    """Everything a final render is made of, saved as render.json in the upload folder."""
+
+    background: str  # Path of the background video
+    start: float  # Keyframe-aligned start in the background video, in seconds
+    duration: float  # Length of the speech, and so of the video
+    speech: str  # Path of speech.wav
+
+    def save(self, folder_path: Path):
+        (Path(folder_path) / "render.json").write_text(json.dumps(asdict(self)), encoding="utf-8")
+
+    @classmethod
+    def load(cls, folder_path: Path) -> Optional["RenderSource"]:
+        path = Path(folder_path) / "render.json"
+        if not path.exists():
+            return None
+        return cls(**json.loads(path.read_text(encoding="utf-8")))
+
+
+def render_options(video_options) -> dict:
+    """The options of `video_options` that `plan_render` reads, with their defaults filled in."""
+    video_options = dict(video_options)
+    return {
+        "video_fadein": video_options.get("video_fadein", 3),
+        "video_fadeout": video_options.get("video_fadeout", 3),
+        "audio_fadein": video_options.get("audio_fadein", 3),
+        "audio_fadeout": video_options.get("audio_fadeout", 3),
+        "profile": get_encoder_profile(video_options.get("profile")),
+    }
+
+
+def plan_render(source: RenderSource, subtitles_path, video_options, output_file):
+    """
+    Builds the single ffmpeg graph of a final render: the background clip is cut, the
+    subtitles burned in and faded, and the speech faded and muxed, in one decode/encode
+    pass over the original inputs. Encoder settings come from `video_options["profile"]`.
+
+    :return: ffmpeg-python output stream, run it with `run_ffmpeg`.
+    """
+    options = render_options(video_options)
+    duration = source.duration
+
+    fadein_duration = options["video_fadein"]
+    fadeout_duration = options["video_fadeout"]
+    audio_fadein = options["audio_fadein"]
+    audio_fadeout = options["audio_fadeout"]
+
+    background = ffmpeg.input(str(source.background), ss=source.start, t=duration)
+    # A muxed video carries its own speech, open it only once
+    speech = background if source.speech == source.background else ffmpeg.input(str(source.speech))
+
+    profile = options["profile"]
+
+    video = background.video
+    # Subtitles are drawn at the output size, after scaling, so they stay sharp and cost less
+    video = video.filter("scale", **profile.scale_filter_args())
+    video = video.filter("ass", filename=str(subtitles_path).replace("\\", "/"), fontsdir=str(fonts_dir).replace("\\", "/"))
+    if fadein_duration > 0:
+        video = video.filter("fade", type="in", start_time=0, duration=fadein_duration)
+    if fadeout_duration > 0:
+        video = video.filter("fade", type="out", start_time=max(0, duration - fadeout_duration), duration=fadeout_duration)
+
+    audio = speech.audio
+    if audio_fadein > 0:
+        audio = audio.filter("afade", type="in", start_time=0, duration=audio_fadein)
+    if audio_fadeout > 0:
+        audio = audio.filter("afade", type="out", start_time=max(0, duration - audio_fadeout), duration=audio_fadeout)
+
+    return ffmpeg.output(video, audio, str(output_file), t=duration, **profile.output_args())
+
+
+def plan_preview(source: RenderSource, subtitles_path, seconds: float, frames: int, output_file):
+    """
+    Builds the ffmpeg graph of a subtitle style preview: the first `seconds` of the
+    render, downscaled and at a low frame rate, without fades.
+
+    :param frames: 0 for a video clip with speech, otherwise the number of still frames
+        spread over the clip and tiled side by side into a single JPEG.
+    :return: ffmpeg-python output stream, run it with `run_ffmpeg`.
+    """
+    seconds = min(seconds, source.duration)
+    profile = PREVIEW_PROFILE
+    background = ffmpeg.input(str(source.background), ss=source.start, t=seconds)
+
+    video = background.video
+    if frames:
+        video = video.filter("fps", fps=f"{frames}/{seconds}")
+    video = video.filter("scale", **profile.scale_filter_args())
+    video = video.filter("ass", filename=str(subtitles_path).replace("\\", "/"), fontsdir=str(fonts_dir).replace("\\", "/"))
+
+    if frames:
+        video = video.filter("tile", layout=f"{frames}x1", padding=4)
+        return ffmpeg.output(video, str(output_file), vframes=1, **{"q:v": 4})
+
+    speech = background if source.speech == source.background else ffmpeg.input(str(source.speech), t=seconds)
+    return ffmpeg.output(video, speech.audio, str(output_file), t=seconds, **profile.output_args())
@@ -0,0 +1,311 @@
+import json
+from dataclasses import asdict, dataclass, field, fields, replace
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+SUBTITLE_POSITIONS = {
+    "bottom-left": 1,
+    "bottom-center": 2,
+    "bottom-right": 3,
+    "middle-left": 4,
+    "center": 5,
+    "middle-right": 6,
+    "top-left": 7,
+    "top-center": 8,
+    "top-right": 9,
+}
+
+SIDECAR_VERSION = 1
+# Lines are held on screen through pauses shorter than this, instead of blinking off
+MAX_HOLD_S = 0.5
+
+
+def convert_subtitle_color(hex_color: str) -> str:
+    """
+    Converts a hex color (#RRGGBB or #AARRGGBB) to the .ass subtitle format (&HAABBGGRR).
+    Colors already in .ass format are returned as they are.
+    """
+    if hex_color.upper().startswith("&H"):
+        return hex_color
+    hex_color = hex_color.lstrip("#")
+    # If only RGB is provided, add default alpha (00 for fully opaque)
+    if len(hex_color) == 6:
+        hex_color = "00" + hex_color
+    alpha, red, green, blue = hex_color[:2], hex_color[2:4], hex_color[4:6], hex_color[6:8]
+    return f"&H{alpha}{blue}{green}{red}".upper()
+
+
+@dataclass
+class SubtitleStyle:
+    """An ASS style, fields in the order of the `[V4+ Styles]` format line."""
+
+    Name: str = "Default"
+    Fontname: str = "Montserrat-VariableFont.ttf"
+    Fontsize: int = 24
+    PrimaryColour: str = "&H00FFFFFF"
+    SecondaryColour: str = "&H000000FF"
+    OutlineColour: str = "&H00000000"
+    BackColour: str = "&H00000000"
+    Bold: int = 1
+    Italic: int = 1
+    Underline: int = 0
+    StrikeOut: int = 0
+    ScaleX: int = 100
+    ScaleY: int = 100
+    Spacing: int = 0
+    Angle: int = 0
+    BorderStyle: int = 1
+    Outline: int = 2
+    Shadow: int = 1
+    Alignment: int = 5
+    MarginL: int = 10
+    MarginR: int = 10
+    MarginV: int = 10
+    Encoding: int = 1
+
+    @classmethod
+    def from_options(cls, options) -> "SubtitleStyle":
+        """Builds the style from `SubtitleOptions` (or a dict of them), converting colors and positions."""
+        options = dict(options)
+        names = {f.name for f in fields(cls)}
+        style = {key: value for key, value in options.items() if key in names}
+        for key in ("PrimaryColour", "SecondaryColour", "OutlineColour", "BackColour"):
+            if key in style:
+                style[key] = convert_subtitle_color(style[key])
+        if isinstance(style.get("Alignment"), str):
+            style["Alignment"] = SUBTITLE_POSITIONS.get(style["Alignment"], 5)
+        return cls(**style)
+
+    def to_ass(self) -> str:
+        return "Style: " + ",".join(str(getattr(self, f.name)) for f in fields(self))
+
+
+@dataclass
+class SubtitleEvent:
+    start: float  # Seconds
+    end: float
+    text: str  # Plain text, lines separated by "\n"
+    style: str = "Default"
+    words: List[Tuple[float, float, str]] = field(default_factory=list)  # (start, end, word) for karaoke
+
+    def karaoke_text(self) -> str:
+        """The words with `\\k` tags, each highlighted from its start until the next word starts."""
+        parts = []
+        elapsed = 0  # Centiseconds, tags are relative so rounding must not drift
+        for i, (start, end, word) in enumerate(self.words):
+            until = self.words[i + 1][0] if i + 1 < len(self.words) else max(end, self.end)
+            until_cs = round((until - self.start) * 100)
+            parts.append(f"{{\\k{max(0, until_cs - elapsed)}}}{word}")
+            elapsed = max(elapsed, until_cs)
+        return " ".join(parts)
+
+
+@dataclass
+class SubtitleDocument:
+    """
+    Subtitles of an upload: styles and timed events, kept as a JSON sidecar next to the
+    upload so restyling swaps a style and re-serializes, without parsing ASS.
+    """
+
+    styles: List[SubtitleStyle] = field(default_factory=list)
+    events: List[SubtitleEvent] = field(default_factory=list)
+    title: str = "Rotmaxxing subtitles"
+    karaoke: bool = False  # Highlight every word as it is spoken
+
+    @classmethod
+    def from_segments(cls, segments, style, max_chars_per_line: int = 25) -> "SubtitleDocument":
+        """
+        Lays out transcription segments as events of at most `max_chars_per_line` characters.
+
+        Segments with word timings (Whisper's `word_timestamps`, `align_text`) are broken
+        into lines in a single pass over the words, each line timed by its own words;
+        segments without them are spread evenly over their time.
+
+        :param segments: Segments with `start`, `end`, `text` and optionally `words`.
+        :param style: `SubtitleOptions` of the default style.
+        """
+        events = []
+        for segment in segments:
+            if getattr(segment, "words", None):
+                events.extend(layout_words(segment.words, max_chars_per_line))
+            else:
+                events.extend(layout_evenly(segment, max_chars_per_line))
+
+        # Hold each line until the next one when the pause between them is short
+        for event, next_event in zip(events, events[1:]):
+            if 0 < next_event.start - event.end < MAX_HOLD_S:
+                event.end = next_event.start
+
+        return cls(
+            styles=[SubtitleStyle.from_options(style)],
+            events=events,
+            karaoke=bool(dict(style).get("Karaoke", False)),
+        )
+
+    def restyle(self, style, name: str = "Default"):
+        """Replaces the style called `name` with `SubtitleOptions` `style`, keeping its name."""
+        new_style = replace(SubtitleStyle.from_options(style), Name=name)
+        self.styles = [s for s in self.styles if s.Name != name] + [new_style]
+        self.karaoke = bool(dict(style).get("Karaoke", self.karaoke))
+
+    def to_ass(self) -> str:
+        lines = [
+            "[Script Info]",
+            f"Title: {self.title}",
+            "ScriptType: v4.00+",
+            "Collisions: Normal",
+            "PlayDepth: 0",
+            "",
+            "[V4+ Styles]",
+            "Format: " + ", ".join(f.name for f in fields(SubtitleStyle)),
+            *(style.to_ass() for style in self.styles),
+            "",
+            "[Events]",
+            "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+        ]
+        for event in self.events:
+            text = event.karaoke_text() if self.karaoke and event.words else event.text.replace("\n", "\\N")
+            lines.append(f"Dialogue: 0,{ass_time(event.start)},{ass_time(event.end)},{event.style},,0,0,0,,{text}")
+        return "\n".join(lines) + "\n"
+
+    def to_srt(self) -> str:
+        blocks = [
+            f"{i}\n{srt_time(event.start)} --> {srt_time(event.end)}\n{event.text}\n"
+            for i, event in enumerate(self.events, start=1)
+        ]
+        return "\n".join(blocks)
+
+    def to_vtt(self) -> str:
+        blocks = ["WEBVTT\n"] + [
+            f"{vtt_time(event.start)} --> {vtt_time(event.end)}\n{event.text}\n"
+            for event in self.events
+        ]
+        return "\n".join(blocks)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "version": SIDECAR_VERSION,
+            "title": self.title,
+            "karaoke": self.karaoke,
+            "styles": [asdict(style) for style in self.styles],
+            # Events as compact rows, they are the bulk of the file
+            "events": [
+                [round(e.start, 3), round(e.end, 3), e.style, e.text, [[round(s, 3), round(t, 3), w] for s, t, w in e.words]]
+                for e in self.events
+            ],
+        }, separators=(",", ":"), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> "SubtitleDocument":
+        data = json.loads(data)
+        return cls(
+            styles=[SubtitleStyle(**style) for style in data["styles"]],
+            events=[
+                SubtitleEvent(start=row[0], end=row[1], style=row[2], text=row[3], words=[tuple(w) for w in row[4]] if len(row) > 4 else [])
+                for row in data["events"]
+            ],
+            title=data.get("title", cls.title),
+            karaoke=data.get("karaoke", False),
+        )
+
+    def save(self, folder_path: Path, ass_path: Optional[Path] = None) -> Path:
+        """
+        Writes subtitles.json, subtitles.ass, subtitles.srt and subtitles.vtt to `folder_path`.
+
+        :param ass_path: Only write the ASS file, to this path, e.g. for a preview.
+        :return: Path of the ASS file.
+        """
+        folder_path = Path(folder_path)
+        if ass_path is not None:
+            Path(ass_path).write_text(self.to_ass(), encoding="utf-8")
+            return Path(ass_path)
+        (folder_path / "subtitles.json").write_text(self.to_json(), encoding="utf-8")
+        (folder_path / "subtitles.srt").write_text(self.to_srt(), encoding="utf-8")
+        (folder_path / "subtitles.vtt").write_text(self.to_vtt(), encoding="utf-8")
+        (folder_path / "subtitles.ass").write_text(self.to_ass(), encoding="utf-8")
+        return folder_path / "subtitles.ass"
+
+    @classmethod
+    def load(cls, folder_path: Path) -> Optional["SubtitleDocument"]:
+        path = Path(folder_path) / "subtitles.json"
+        if not path.exists():
+            return None
+        return cls.from_json(path.read_text(encoding="utf-8"))
+
+
+def layout_words(words, max_chars_per_line: int) -> List[SubtitleEvent]:
+    """
+    Breaks timed words into lines in one pass: a word starts a new line when it would
+    make the line longer than `max_chars_per_line`. Every line is joined once, when closed.
+
+    :param words: Words with `start`, `end` and `word`, e.g. faster-whisper `Word` or `AlignedWord`.
+    """
+    events, line, length = [], [], 0
+
+    def close_line():
+        events.append(SubtitleEvent(
+            start=line[0][0],
+            end=line[-1][1],
+            text=" ".join(word for _, _, word in line),
+            words=list(line),
+        ))
+
+    for word in words:
+        text = word.word.strip()
+        if not text:
+            continue
+        if line and length + 1 + len(text) > max_chars_per_line:
+            close_line()
+            line, length = [], 0
+        length += len(text) + (1 if line else 0)
+        line.append((float(word.start), float(word.end), text))
+    if line:
+        close_line()
+    return events
+
+
+def layout_evenly(segment, max_chars_per_line: int) -> List[SubtitleEvent]:
+    """Splits a segment without word timings into lines spread evenly over its time."""
+    chunks, current, length = [], [], 0
+    for word in segment.text.split():
+        if current and length + 1 + len(word) > max_chars_per_line:
+            chunks.append(" ".join(current))
+            current, length = [], 0
+        length += len(word) + (1 if current else 0)
+        current.append(word)
+    if current:
+        chunks.append(" ".join(current))
+
+    chunk_duration = (segment.end - segment.start) / max(1, len(chunks))
+    return [
+        SubtitleEvent(
+            start=segment.start + i * chunk_duration,
+            end=segment.start + (i + 1) * chunk_duration,
+            text=chunk,
+        )
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+def split_time(seconds: float, unit: int):
+    """Splits `seconds` into hours, minutes, seconds and `unit`ths of a second, rounded once."""
+    total = max(0, round(seconds * unit))
+    fraction = total % unit
+    total //= unit
+    return total // 3600, total // 60 % 60, total % 60, fraction
+
+
+def ass_time(seconds: float) -> str:
+    # ASS times are in centiseconds
+    hours, minutes, secs, cs = split_time(seconds, 100)
+    return f"{hours}:{minutes:02}:{secs:02}.{cs:02}"
+
+
+def srt_time(seconds: float) -> str:
+    hours, minutes, secs, ms = split_time(seconds, 1000)
+    return f"{hours:02}:{minutes:02}:{secs:02},{ms:03}"
+
+
+def vtt_time(seconds: float) -> str:
+    hours, minutes, secs, ms = split_time(seconds, 1000)
+    return f"{hours:02}:{minutes:02}:{secs:02}.{ms:03}"
@@ -1,29 +1,181 @@
 from pathlib import Path
 from fastapi import HTTPException
-from openai import OpenAI
+from openai import AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
+import asyncio
+import httpx
+import json
 import os
-from pydub.utils import mediainfo
+import random
+import re
+import shutil
+import unicodedata
+import uuid
+import wave
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from server import metrics
+from server.utils.disk_cache import DiskCache
+
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", 4))
+TTS_MAX_RETRIES = int(os.getenv("TTS_MAX_RETRIES", 3))
+
+# One pooled HTTP client for the whole process, so synthesis reuses keep-alive connections.
+# The endpoint can be pointed at a stub server with OPENAI_BASE_URL.
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=TTS_CONCURRENCY, max_keepalive_connections=TTS_CONCURRENCY),
+        timeout=httpx.Timeout(120, connect=10),
+    ),
+    max_retries=0,  # Retried in synthesize_speech, outside of the concurrency slot
+)
+tts_semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
 
 output_dest = Path(__file__).resolve().parent.parent.parent / "static" / "uploads"
 
-async def text_to_speech(text: str, voice: str = "alloy", folder_id: str = None) -> Path:
+TTS_MODEL = "tts-1"
+# Raw 16-bit mono samples at 24 kHz: segments concatenate without decoding and durations
+# follow from the byte count, no probing needed
+TTS_FORMAT = "pcm"
+PCM_SAMPLE_RATE = 24000
+PCM_SAMPLE_WIDTH = 2
+
+tts_cache = DiskCache(
+    root=Path(__file__).resolve().parent.parent.parent / "static" / "cache" / "tts",
+    max_bytes=int(os.getenv("TTS_CACHE_MAX_MB", 1024)) * 1024 * 1024,
+    suffix=f".{TTS_FORMAT}",
+)
+
+async def text_to_speech(text: str, voice: str = "alloy", folder_id: str = None, split_sentences: bool = False) -> Path:
+    """
+    Synthesizes `text` to speech.wav, with its per-segment timings in speech.json.
+
+    :param split_sentences: Split the script at sentence boundaries and synthesize the
+        segments concurrently instead of in one long request.
+    :return: Path to the WAV file and its duration in seconds.
+    """
     try:
         voices = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
         if voice not in voices:
             raise ValueError(f"Voice {voice} not found. Available voices: {voices}")
         speech_file_path = output_dest / str(folder_id) / "speech.wav" if folder_id else output_dest / "speech.wav"
         
-        # Using OpenAI TTS to generate audio
-        response = client.audio.speech.create(model="tts-1", voice=voice, input=text, response_format="wav")
-        response.stream_to_file(speech_file_path)
-        duration = await get_audio_duration(str(speech_file_path))
-        return speech_file_path, duration
+        segments = split_into_sentences(text) if split_sentences else [text]
+        with metrics.timed("tts"):
+            results = await asyncio.gather(
+                *(synthesize_segment(segment, voice, speech_file_path.parent) for segment in segments),
+                return_exceptions=True,
+            )
+            pcm_paths = [result for result in results if isinstance(result, Path)]
+            try:
+                for result in results:
+                    if isinstance(result, BaseException):
+                        raise result
+                durations = await asyncio.to_thread(write_wav, pcm_paths, speech_file_path)
+            finally:
+                for pcm_path in pcm_paths:
+                    pcm_path.unlink(missing_ok=True)
+
+        timings, start = [], 0.0
+        for segment, duration in zip(segments, durations):
+            timings.append({"text": segment, "start": start, "end": start + duration})
+            start += duration
+        speech_file_path.with_suffix(".json").write_text(json.dumps({"segments": timings}), encoding="utf-8")
+        return speech_file_path, start
     
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
     
-async def get_audio_duration(file_path: str) -> float:
-    info = mediainfo(file_path)
-    return float(info['duration'])
\ No newline at end of file
+async def synthesize_segment(text: str, voice: str, tmp_dir: Path) -> Path:
+    """
+    Writes the PCM of one segment to a file of its own in `tmp_dir`, linked from the
+    cache when possible and synthesized on a miss. The caller deletes the file.
+    """
+    # Same text and voice always produce the same speech, reuse it when we can
+    cache_key = tts_cache.make_key(TTS_MODEL, voice, TTS_FORMAT, normalize_text(text))
+    # Unique, the same segment can appear twice in one script
+    tmp_path = tmp_dir / f"speech_{uuid.uuid4().hex}.pcm"
+    if tts_cache.lookup(cache_key) is not None:
+        try:
+            # Pinned in the job folder, the cache may evict its copy any time
+            await asyncio.to_thread(pin_file, tts_cache.path(cache_key), tmp_path)
+            return tmp_path
+        except FileNotFoundError:
+            pass  # Evicted since the lookup, synthesize it again
+
+    try:
+        with metrics.timed("tts_request"):
+            await synthesize_speech(text, voice, tmp_path, response_format=TTS_FORMAT)
+        await tts_cache.store(cache_key, tmp_path, {"duration": tmp_path.stat().st_size / (PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH)})
+        return tmp_path
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def pin_file(source: Path, destination: Path):
+    """Hard-links `source` to `destination`, copying it when they are on different file systems."""
+    try:
+        os.link(source, destination)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def write_wav(pcm_paths, speech_file_path: Path) -> list:
+    """Concatenates PCM files in order into one WAV file and returns the duration of each."""
+    durations = []
+    with wave.open(str(speech_file_path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(PCM_SAMPLE_WIDTH)
+        wav.setframerate(PCM_SAMPLE_RATE)
+        for pcm_path in pcm_paths:
+            size = 0
+            with open(pcm_path, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    wav.writeframesraw(chunk)
+                    size += len(chunk)
+            durations.append(size / (PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH))
+    return durations
+
+def split_into_sentences(text: str, min_chars: int = 200) -> list:
+    """
+    Splits a script at sentence boundaries, merging short sentences until a segment
+    has at least `min_chars`, so tiny requests don't dominate with their latency.
+    """
+    segments, current = [], ""
+    for sentence in re.split(r"(?<=[.!?…])\s+", text.strip()):
+        current = f"{current} {sentence}" if current else sentence
+        if len(current) >= min_chars:
+            segments.append(current)
+            current = ""
+    if current:
+        segments.append(current)
+    return segments
+
+async def synthesize_speech(text: str, voice: str, speech_file_path: Path, response_format: str = TTS_FORMAT):
+    """
+    Streams OpenAI TTS audio to `speech_file_path` as it arrives.
+
+    Connection errors, rate limits and server errors are retried with exponential
+    backoff and jitter, at most TTS_CONCURRENCY requests are in flight at once.
+    """
+    for attempt in range(TTS_MAX_RETRIES + 1):
+        try:
+            async with tts_semaphore:
+                async with client.audio.speech.with_streaming_response.create(
+                    model=TTS_MODEL, voice=voice, input=text, response_format=response_format
+                ) as response:
+                    with open(speech_file_path, "wb") as f:
+                        async for chunk in response.iter_bytes(64 * 1024):
+                            f.write(chunk)
+            return
+        except (APIConnectionError, RateLimitError, InternalServerError):
+            if attempt == TTS_MAX_RETRIES:
+                raise
+            await asyncio.sleep(min(0.5 * 2 ** attempt, 8) * random.uniform(0.5, 1.0))
+
+async def close_client():
+    await client.close()
+
+def normalize_text(text: str) -> str:
+    """Normalizes what doesn't change the spoken result: unicode form and whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
\ No newline at end of file
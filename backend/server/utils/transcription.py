@@ -0,0 +1,87 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from faster_whisper import WhisperModel, decode_audio
+
+from server import metrics
+
+# Whisper works on 16 kHz mono float32 samples
+SAMPLE_RATE = 16000
+
+
+class TranscriptionService:
+    """
+    Shared faster-whisper model with a bounded pool of transcription threads.
+
+    The model is loaded on first use instead of at import, and every transcription runs
+    on the service's own pool, so concurrent requests queue for a thread instead of
+    oversubscribing the CPU through the default executor.
+    """
+
+    def __init__(self, model_size="tiny", device="cpu", compute_type="int8", cpu_threads=2, max_workers=None):
+        self.model_size = model_size
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 1) // cpu_threads)
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = WhisperModel(
+                        self.model_size,
+                        device=self.device,
+                        compute_type=self.compute_type,
+                        cpu_threads=self.cpu_threads,
+                        num_workers=self.max_workers,
+                    )
+        return self._model
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="whisper")
+        return self._executor
+
+    async def decode_audio(self, file_path: str):
+        """Decodes `file_path` once into a 16 kHz mono float32 NumPy array."""
+        loop = asyncio.get_running_loop()
+        with metrics.timed("decode_audio"):
+            return await loop.run_in_executor(self.executor, partial(decode_audio, str(file_path), sampling_rate=SAMPLE_RATE))
+
+    async def transcribe(self, audio, **kwargs) -> list:
+        """
+        Transcribes `audio` (a path or a 16 kHz float32 array) on the pool.
+
+        :param kwargs: Passed through to `WhisperModel.transcribe`.
+        :return: The list of transcribed segments.
+        """
+        loop = asyncio.get_running_loop()
+        with metrics.whisper_running.track_inprogress():
+            return await loop.run_in_executor(self.executor, partial(self._transcribe, audio, **kwargs))
+
+    def _transcribe(self, audio, **kwargs) -> list:
+        segments, info = self.model.transcribe(audio, **kwargs)
+        # Segments are generated lazily, consume them on the pool thread
+        return list(segments)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+transcription_service = TranscriptionService(
+    model_size=os.getenv("WHISPER_MODEL", "tiny"),
+    device=os.getenv("WHISPER_DEVICE", "cpu"),
+    compute_type=os.getenv("WHISPER_COMPUTE_TYPE", "int8"),
+    cpu_threads=int(os.getenv("WHISPER_CPU_THREADS", 2)),
+    max_workers=int(os.getenv("WHISPER_WORKERS") or 0) or None,
+)
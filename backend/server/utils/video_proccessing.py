@@ -1,73 +1,142 @@
+from dataclasses import asdict
 from pathlib import Path
 import ffmpeg
 import asyncio
+import hashlib
+import json
+import os
 import random
+import uuid
+
+from server import metrics
+from server.utils.ffmpeg_runner import run_ffmpeg, probe
+from server.utils.render_planner import RenderSource, plan_preview, plan_render, render_options
+from server.utils.generate_subtitles import update_subtitles_style
+from server.utils.disk_cache import DiskCache
 
 
 output_dest = Path(__file__).resolve().parent.parent.parent / "static" / "uploads"
-fonts_dir = Path(__file__).resolve().parent.parent.parent / "static" / "fonts"
+
+render_cache = DiskCache(
+    root=Path(__file__).resolve().parent.parent.parent / "static" / "cache" / "renders",
+    max_bytes=int(os.getenv("RENDER_CACHE_MAX_MB", 4096)) * 1024 * 1024,
+    suffix=".mp4",
+)
+# Renders being encoded right now, by cache key
+renders_in_flight = {}
 
 
-async def add_audio_to_video(video_path, audio_path, folder_id, video_duration):
+async def add_audio_to_video(video_path, audio_path, folder_id, video_duration, start=None, on_progress=None):
     try:
         output_file = output_dest / str(folder_id) / f"temp_vid_with_audio.mp4"
         video_path, audio_path = map(str, (video_path, audio_path))
-        random_start = random.uniform(await get_video_duration(video_path) - video_duration, 0)
-        video_input_stream = ffmpeg.input(str(video_path), t=video_duration, ss=random_start)
+        if start is None:
+            # Prefer a keyframe-aligned start from the background library, copying from anywhere else isn't exact
+            start = random.uniform(0, max(0, await get_video_duration(video_path) - video_duration))
+        video_input_stream = ffmpeg.input(str(video_path), t=video_duration, ss=start)
         audio_input_stream = ffmpeg.input(str(audio_path))
-        ffmpeg.output(video_input_stream.video, audio_input_stream.audio, str(output_file), vcodec='copy', acodec='copy', preset="ultrafast").run(overwrite_output=True)
+        with metrics.timed("mux"):
+            await run_ffmpeg(
+                ffmpeg.output(video_input_stream.video, audio_input_stream.audio, str(output_file), vcodec='copy', acodec='copy', preset="ultrafast"),
+                duration=video_duration,
+                on_progress=on_progress,
+            )
         return str(output_file)
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
 
 async def process_video_output(
-    video_path, subtitles_path, folder_id, video_options
+    video_path, subtitles_path, folder_id, video_options, on_progress=None
 ):
+    """
+    Renders the final video in a single ffmpeg pass, see `plan_render`.
+
+    Renders are cached under a hash of everything they are made of, so a repeated
+    request returns instantly, and simultaneous identical requests share one encode.
+
+    :param video_path: The muxed preview video, only used for uploads generated before
+        render.json existed.
+    :return: Path of the rendered video in the render cache.
+    """
     try:
-        video_options = dict(video_options)
-    
-        output_file = output_dest / str(folder_id) / "result.mp4"
-
-        
-        fadein_duration = video_options.get("video_fadein", 3)
-        fadeout_duration = video_options.get("video_fadeout", 3)
-        
-        audio_fadein = video_options.get("audio_fadein", 3)
-        audio_fadeout = video_options.get("audio_fadeout", 3)
-        
-        video_input_stream = ffmpeg.input(str(video_path))
-        video_duration = await get_video_duration(video_path)
-
-        # Add subtitles filter
-        video_input_stream = video_input_stream.filter('ass', filename=str(subtitles_path).replace("\\", "/"))
-        
-        # Apply fade in/out to video
-        video_input_stream = video_input_stream.filter('fade', type='in', start_time=0, duration=fadein_duration)
-        video_input_stream = video_input_stream.filter('fade', type='out', start_time=max(0, video_duration - fadeout_duration), duration=fadeout_duration)
-
-        # Handle audio - apply fade-in/fade-out
-        audio_input_stream = ffmpeg.input(str(video_path))
-        
-        # Apply audio fade-in/out if specified
-        if audio_fadein > 0:
-            audio_input_stream = audio_input_stream.filter('afade', type='in', start_time=0, duration=audio_fadein)
-        if audio_fadeout > 0:
-            audio_input_stream = audio_input_stream.filter('afade', type='out', start_time=max(0, video_duration - audio_fadeout), duration=audio_fadeout)
-
-        # Combine video and audio streams
-        video_input_stream = ffmpeg.output(video_input_stream, audio_input_stream, str(output_file), vcodec='libx264', acodec='aac', preset='ultrafast')
-        ffmpeg.run(video_input_stream, overwrite_output=True)
-        
-        return str(output_file)
+        source = await load_render_source(folder_id, video_path)
+        key = await render_key(source, subtitles_path, video_options)
+        if render_cache.lookup(key) is not None:
+            return str(render_cache.path(key))
+
+        render = renders_in_flight.get(key)
+        if render is None:
+            render = asyncio.create_task(render_to_cache(key, source, subtitles_path, video_options, on_progress))
+            renders_in_flight[key] = render
+            render.add_done_callback(lambda _: renders_in_flight.pop(key, None))
+        # Shielded, so one client going away doesn't cancel the encode for the others
+        return str(await asyncio.shield(render))
 
     except Exception as e:
         print(f"Error processing video: {e}")
         return None
 
+async def load_render_source(folder_id, video_path=None) -> RenderSource:
+    folder_path = output_dest / str(folder_id)
+    source = RenderSource.load(folder_path)
+    if source is None:
+        # Generated before render.json existed, the muxed video is both background and speech
+        video_path = video_path or folder_path / "temp_vid_with_audio.mp4"
+        source = RenderSource(
+            background=str(video_path),
+            start=0,
+            duration=await get_video_duration(video_path),
+            speech=str(video_path),
+        )
+    return source
+
+async def render_preview(folder_id, style, seconds: float = 3, frames: int = 4) -> bytes:
+    """
+    Renders a quick look at a subtitle style over the start of the video, see
+    `plan_preview`. The folder's subtitles are left untouched.
+
+    :param frames: 0 for a short MP4 clip, otherwise a JPEG of that many still frames.
+    :return: The MP4 or JPEG data.
+    """
+    folder_path = output_dest / str(folder_id)
+    source = await load_render_source(folder_id)
+    name = f"preview-{uuid.uuid4().hex}"
+    subtitles_path = folder_path / f"{name}.ass"
+    output_file = folder_path / f"{name}.{'jpg' if frames else 'mp4'}"
+    try:
+        await update_subtitles_style(folder_id, style, output_path=subtitles_path)
+        with metrics.timed("preview"):
+            await run_ffmpeg(plan_preview(source, subtitles_path, seconds, frames, output_file), timeout=30)
+        return await asyncio.to_thread(output_file.read_bytes)
+    finally:
+        subtitles_path.unlink(missing_ok=True)
+        output_file.unlink(missing_ok=True)
+
+async def render_to_cache(key, source, subtitles_path, video_options, on_progress=None):
+    output_file = render_cache.temp_path(key)
+    try:
+        stream = plan_render(source, subtitles_path, video_options, output_file)
+        with metrics.timed("render"):
+            await run_ffmpeg(stream, duration=source.duration, on_progress=on_progress)
+        return await render_cache.store(key, output_file, {"duration": source.duration}, move=True)
+    finally:
+        output_file.unlink(missing_ok=True)
+
+async def render_key(source, subtitles_path, video_options) -> str:
+    subtitles = await asyncio.to_thread(Path(subtitles_path).read_bytes)
+    # Only what the render reads, so e.g. video_duration doesn't split identical renders
+    options = render_options(video_options)
+    options["profile"] = asdict(options["profile"])
+    return render_cache.make_key(
+        json.dumps(asdict(source), sort_keys=True),
+        hashlib.sha256(subtitles).hexdigest(),
+        json.dumps(options, sort_keys=True),
+    )
+
 async def get_video_duration(video_path):
-    probe = ffmpeg.probe(str(video_path), v='error', select_streams='v:0', show_entries='format=duration')
-    return float(probe['format']['duration'])
+    info = await probe(str(video_path), v='error', select_streams='v:0', show_entries='format=duration')
+    return float(info['format']['duration'])
 
 async def main():
     await process_video_output(
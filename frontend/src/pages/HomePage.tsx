@@ -19,6 +19,7 @@ const HomePage: React.FC = () => {
    const { toast } = useToast();
    const [filters, setFilters] = useState<any>({});
    const API_URL = 'http://localhost:8001';
+   const JOB_TIMEOUT_MS = 10 * 60 * 1000;
    const { user, fetchMe } = AuthHandler();
    const [text, setText] = useState<string>('');
    const [folderId, setFolderId] = useState<string | null>(null);
@@ -57,6 +58,20 @@ const HomePage: React.FC = () => {
    //    }
    // };
 
+   const waitForJob = async (jobId: string): Promise<any> => {
+      const deadline = Date.now() + JOB_TIMEOUT_MS;
+      while (Date.now() < deadline) {
+         const response = await axios.get(`${API_URL}/uploads/jobs/${jobId}`, {
+            withCredentials: true,
+         });
+         if (['completed', 'failed'].includes(response.data.status)) {
+            return response.data;
+         }
+         await new Promise((resolve) => setTimeout(resolve, 1500));
+      }
+      return { status: 'failed', error: 'The video is taking too long, try again later' };
+   };
+
    const generateBrainrot = async () => {
       try {
          if (assRef.current) {
@@ -84,16 +99,27 @@ const HomePage: React.FC = () => {
                headers: {
                   'Content-Type': 'application/json',
                },
-               responseType: 'arraybuffer',
                withCredentials: true,
             }
          );
+         const job = await waitForJob(response.data._id);
+         if (job.status !== 'completed') {
+            toast({
+               title: 'Failed',
+               description: job.error || 'Failed to generate video',
+            });
+            return;
+         }
+         const result = await axios.get(`${API_URL}${job.result.url}`, {
+            responseType: 'arraybuffer',
+            withCredentials: true,
+         });
          const zip = new JSZip();
-         const zipFileName = response.headers['content-disposition']
+         const zipFileName = result.headers['content-disposition']
             .split('filename=')[1]
             .replace(/"/g, '')
             .trim();
-         const content = await zip.loadAsync(response.data);
+         const content = await zip.loadAsync(result.data);
          const videoFile = content.file('temp_vid_with_audio.mp4');
          const subtitleFile = content.file('subtitles.ass');
          if (videoFile && subtitleFile && zipFileName) {